@@ -1,27 +1,43 @@
 # auth/auth.py
+import os
 from pydantic import BaseModel
+from keystore import KEYSTORE_PATH, validator_ids
 
 class User(BaseModel):
     username: str
     password: str
     role: str  # "usuario" or "autoridad"
 
-# Users: includes validator accounts (their username matches validator node ids)
+# Regular users
 USERS_DB = {
     "alice": User(username="alice", password="alicepw", role="usuario"),
     "maria": User(username="maria", password="mariapw", role="usuario"),
-    "validator_1": User(username="validator_1", password="valpw", role="autoridad"),
-    "validator_2": User(username="validator_2", password="valpw", role="autoridad"),
-    "validator_3": User(username="validator_3", password="valpw", role="autoridad"),
-    "validator_4": User(username="validator_4", password="valpw", role="autoridad"),
-    "validator_5": User(username="validator_5", password="valpw", role="autoridad")
 }
 
+# Validator accounts: one per validator of the latest keystore epoch (their
+# username matches the validator node id), so BLOCKCHAIN_VALIDATORS=200 or a
+# key rotation gets logins for every validator without editing this file.
+VALIDATOR_PASSWORD = "valpw"
+_validators = {"mtime": None, "users": {}}
+
+def _validator_users():
+    try:
+        mtime = os.path.getmtime(KEYSTORE_PATH)
+    except OSError:
+        return {}
+    if mtime != _validators["mtime"]:
+        _validators["users"] = {
+            vid: User(username=vid, password=VALIDATOR_PASSWORD, role="autoridad")
+            for vid in validator_ids(KEYSTORE_PATH)
+        }
+        _validators["mtime"] = mtime
+    return _validators["users"]
+
 def authenticate(username: str, password: str):
-    user = USERS_DB.get(username)
+    user = get_user_by_username(username)
     if not user or user.password != password:
         return None
     return user
 
 def get_user_by_username(username: str):
-    return USERS_DB.get(username)
+    return USERS_DB.get(username) or _validator_users().get(username)
@@ -0,0 +1,87 @@
+# block_log.py
+import os
+import json
+import struct
+import zlib
+
+# ======== FORMATO DEL LOG ========
+# Cada bloque confirmado se agrega al final de un segmento (block_store) como
+# un registro:
+#
+#   [longitud u32][payload][longitud u32][crc32 u32]
+#
+# El prefijo de longitud permite recorrer el archivo hacia adelante y el
+# trailer (longitud + CRC32 del payload) permite detectar registros corruptos.
+
+RECORD_HEADER = struct.Struct("<I")
+RECORD_TRAILER = struct.Struct("<II")
+RECORD_OVERHEAD = RECORD_HEADER.size + RECORD_TRAILER.size
+
+
+def encode_record(payload: bytes) -> bytes:
+    n = len(payload)
+    return RECORD_HEADER.pack(n) + payload + RECORD_TRAILER.pack(n, zlib.crc32(payload))
+
+
+def fsync_dir(directory):
+    """Hace durable la creación/renombrado de archivos dentro del directorio."""
+    if os.name != "posix":
+        return  # En Windows no se puede abrir un directorio para fsync
+    fd = os.open(directory or ".", os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def atomic_write(path, data: bytes):
+    """Escribe un archivo completo de forma atómica (temporal + fsync + rename)."""
+    tmp = path + ".tmp"
+    with open(tmp, "wb") as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+    fsync_dir(os.path.dirname(path))
+
+
+def scan_records(f):
+    """
+    Recorre los registros de un archivo abierto en modo binario: produce
+    (offset, payload) y se detiene sin error en el primer registro truncado,
+    corrupto o vacío (ningún registro tiene payload vacío: una zona en ceros
+    tras un corte de energía no pasa por registros válidos). El final del último registro válido es donde debe truncarse
+    la cola rota.
+    """
+    offset = f.tell()
+    while True:
+        head = f.read(RECORD_HEADER.size)
+        if len(head) < RECORD_HEADER.size:
+            return
+        (n,) = RECORD_HEADER.unpack(head)
+        if n == 0:
+            return
+        payload = f.read(n)
+        trailer = f.read(RECORD_TRAILER.size)
+        if len(payload) < n or len(trailer) < RECORD_TRAILER.size:
+            return
+        n2, crc = RECORD_TRAILER.unpack(trailer)
+        if n2 != n or crc != zlib.crc32(payload):
+            return
+        yield offset, payload
+        offset += RECORD_OVERHEAD + n
+
+
+def migrate_json_chain(json_filename, log_filename):
+    """
+    Migración única: convierte el archivo JSON antiguo (arreglo con todos los
+    bloques) en un log de registros. El JSON original se conserva renombrado.
+    """
+    with open(json_filename, "r") as f:
+        data = json.load(f)
+
+    records = [encode_record(json.dumps(b_data, separators=(",", ":")).encode()) for b_data in data]
+    atomic_write(log_filename, b"".join(records))
+    os.replace(json_filename, json_filename + ".migrated")
+    print(f"[PERSISTENCIA] Migrados {len(data)} bloques de {json_filename} a {log_filename}")
+    return len(data)
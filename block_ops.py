@@ -1,166 +1,279 @@
 # block_ops.py
+import asyncio
+import threading
+import secrets
 from fastapi import HTTPException
-from blockchain import Transaction, Block, sign_message, verify_signature, select_leader, get_current_timestamp
+from blockchain import Transaction, Block, SealError, sign_message, select_leader, get_current_timestamp
+from offload import run_crypto
+from pending_pool import has_signed
+from quorum import Approvals
 from state import (
-    chain,
     validators,
+    validators_by_id,
+    validator_set,
+    sig_cache,
     pending_blocks,
-    pending_id_counter,
-    q
+    mempool,
+    deadlines,
+    writer
 )
 
-def propose_block_from_tx(tx: Transaction):
-    """Crea una propuesta de bloque a partir de una transacción."""
-    global pending_id_counter
+# ======== MODELO DE CONCURRENCIA ========
+# - Cada propuesta tiene su propio lock (pb["lock"]): firmar, decidir el
+#   quórum y rechazar se serializan por propuesta, no globalmente. Una vez
+#   decidida (pb["decided"]) ninguna otra firma o rechazo la toca.
+# - Solo el escritor (chain_writer.ChainWriter) agrega bloques a la cadena.
+# - Los lectores no toman locks: approvals/verified se reemplazan (copy on
+#   write) en lugar de mutarse, el pool entrega tuplas inmutables y la cadena
+#   se lee desde una instantánea de largo fijo (chain.snapshot()).
+# - Las aprobaciones son quorum.Approvals (bitmap + firmas empaquetadas)
+#   sobre las posiciones del conjunto de validadores de la propuesta: contar
+#   el quórum es len() y cada firma nueva produce un objeto nuevo.
 
-    index = len(chain.chain)
-    prev_hash = chain.last_hash()
-    leader_node = select_leader(validators, index)
+
+def record_approval(pb, validator_id: str, sig: str) -> bool:
+    """
+    Registra una aprobación y verifica solo esa firma (con caché). Las firmas
+    ya verificadas quedan en pb["verified"], así que contar el quórum cuesta
+    O(1) por firma nueva en lugar de re-verificar todas las anteriores.
+    """
+    vset = pb["validators"]
+    pos = vset.position.get(validator_id)
+    if pos is None:
+        return False
+    raw = bytes.fromhex(sig)
+    pb["approvals"] = pb["approvals"].with_signature(pos, raw)
+    pending_blocks.mark_signed(pb["id"], validator_id)
+    if sig_cache.verify(validator_id, vset.keys[pos], pb["digest"], sig):
+        pb["verified"] = pb["verified"].with_signature(pos, raw)
+        return True
+    return False
+
+
+def _certify(pb, status):
+    """Copia las firmas verificadas al bloque y arma su certificado."""
+    vset = pb["validators"]
+    block = pb["block"]
+    block.signatures = pb["verified"].to_signatures(vset)
+    block.certificate = {
+        "status": status,
+        "q_required": vset.q,
+        "q_collected": len(pb["verified"])
+    }
+    return block
+
+
+def _approve(pb, v_node, consensus_timestamp=None):
+    """
+    Firma y registra la aprobación de v_node bajo el lock de la propuesta.
+    Retorna las firmas válidas reunidas; si alcanzan el quórum la propuesta
+    queda decidida como ACCEPTED y el llamador debe enviarla al escritor.
+    """
+    with pb["lock"]:
+        if pb["decided"]:
+            raise HTTPException(status_code=409, detail="La propuesta ya fue decidida")
+        if has_signed(pb, v_node.id):
+            if len(pb["verified"]) >= pb["validators"].q:
+                # Ya tenía quórum pero su sellado falló: se reintenta
+                return _accept(pb, consensus_timestamp)
+            raise HTTPException(status_code=400, detail="Ya has firmado este bloque")
+
+        # Firmar el digest de contenido y verificar solo la firma nueva
+        sig = sign_message(v_node.signing_key, pb["digest"])
+        record_approval(pb, v_node.id, sig)
+
+        # Chequear Quórum (las firmas anteriores ya están verificadas)
+        collected = len(pb["verified"])
+        if collected >= pb["validators"].q:
+            return _accept(pb, consensus_timestamp)
+        _certify(pb, "PENDING")
+        return collected
+
+
+def _accept(pb, consensus_timestamp=None):
+    """Decide la propuesta como ACCEPTED (bajo su lock). Retorna las firmas válidas."""
+    block = _certify(pb, "ACCEPTED")
+    block.certificate["consensus_timestamp"] = consensus_timestamp or get_current_timestamp()
+    pb["decided"] = True
+    return len(pb["verified"])
+
+
+def _reject(pb, reason: str) -> bool:
+    """Decide la propuesta como REJECTED; False si otro ya la había decidido."""
+    with pb["lock"]:
+        if pb["decided"]:
+            return False
+        # Firmas válidas (verificadas al registrarse cada aprobación)
+        block = _certify(pb, "REJECTED")
+        block.certificate["reason"] = reason
+        pb["decided"] = True
+        return True
+
+
+async def commit_pending(pbs):
+    """
+    Envía propuestas ya decididas al escritor único, que las sella en alturas
+    consecutivas dentro de un mismo lote de persistencia (un fsync
+    compartido). Retorna cuando cada una es durable o falló, con la lista de
+    (propuesta, error) de las que fallaron.
+
+    Una propuesta sale del pool solo si su bloque quedó en la cadena. Si no
+    se pudo sellar (SealError) vuelve a quedar pendiente, con sus firmas:
+    una nueva firma o un nuevo rechazo la vuelven a enviar.
+    """
+    futures = writer.submit([pb["block"] for pb in pbs])
+    results = await asyncio.gather(*map(asyncio.wrap_future, futures), return_exceptions=True)
+    failed = []
+    for pb, result in zip(pbs, results):
+        if isinstance(result, SealError):
+            _reopen(pb)
+        else:
+            pending_blocks.remove(pb["id"])
+        if isinstance(result, Exception):
+            print(f"[ERROR] La propuesta #{pb['id']} no se pudo confirmar: {result}")
+            failed.append((pb, result))
+    return failed
+
+
+def _reopen(pb):
+    """Devuelve a pendiente una propuesta decidida cuyo bloque no se escribió."""
+    with pb["lock"]:
+        block = _certify(pb, "PENDING")
+        block.index, block.previous_hash, block.block_hash = -1, "", ""
+        pb["decided"] = False
+    deadlines.schedule(pb["id"])
+
+
+def _raise_failed(failed):
+    """Error HTTP para el llamador de una sola propuesta cuyo commit falló."""
+    if failed:
+        pb, error = failed[0]
+        raise HTTPException(status_code=500, detail=f"No se pudo confirmar la propuesta #{pb['id']}: {error}")
+
+
+def _common(values, default):
+    """El valor compartido por todas las transacciones del lote, o default."""
+    first = values[0] if values else default
+    return first if all(v == first for v in values) else default
+
+
+async def submit_transaction(tx: Transaction):
+    """
+    Encola la transacción en el mempool. Si con ella el lote se llena, se
+    propone el bloque de inmediato; si no, lo cortará el plazo de linger.
+    """
+    batch = mempool.add(tx.to_dict())
+    if batch:
+        return await propose_batch(batch)
+    return None
+
+
+async def propose_batch(txs):
+    """propose_block_from_txs fuera del event loop (raíz de Merkle y firma del líder)."""
+    return await run_crypto(propose_block_from_txs, txs)
+
+
+def propose_block_from_txs(txs):
+    """
+    Crea una propuesta de bloque con un lote de transacciones del mempool.
+    La altura y el padre no se fijan aquí: chain.add_blocks los asigna al
+    sellar, así varias propuestas pueden estar en consenso al mismo tiempo.
+    """
+    pending_id = pending_blocks.next_id()
+
+    # El liderazgo rota por número de propuesta
+    leader_node = select_leader(validators, pending_id)
 
     # Creamos el bloque con Timestamp legible
     block = Block(
-        index=index,
-        previous_hash=prev_hash,
+        index=-1,           # se asigna al sellar
+        previous_hash="",   # se asigna al sellar
         timestamp=get_current_timestamp(),
         leader=leader_node.id,
-        stage_name=tx.payload.get("stage", "Etapa General"),
-        transactions=[tx.to_dict()],
-        # Si la tx ya trae un responsable firmado, lo subimos al nivel de bloque
-        responsible_id=tx.responsible_id 
+        stage_name=_common([tx["payload"].get("stage", "Etapa General") for tx in txs], "Varias etapas"),
+        transactions=txs,
+        # Si todas las tx traen el mismo responsable firmado, lo subimos al nivel de bloque
+        responsible_id=_common([tx.get("responsible_id", "") for tx in txs], ""),
+        # Entra en el digest de contenido: dos propuestas nunca lo comparten
+        nonce=secrets.token_hex(16),
     )
     
-    # Calculamos el hash (esto llama al header_dict corregido)
-    block.compute_hash()
-
-    # Preparamos el objeto para la lista de pendientes
+    # Preparamos el objeto para la lista de pendientes. Los validadores firman
+    # el digest de contenido, que no cambia al asignar altura y padre.
     pb = {
-        "id": pending_id_counter,
+        "id": pending_id,
         "block": block,
-        "approvals": {}  # validator_id -> firma hex
+        "digest": block.signing_message(),
+        "validators": validator_set,  # época cuyas posiciones usan los bitmaps
+        "approvals": Approvals(),     # bitmap de firmantes + firmas empaquetadas
+        "verified": Approvals(),      # subconjunto de approvals con firma ya verificada
+        "lock": threading.Lock(),
+        "decided": False  # True al alcanzar quórum o al rechazarse
     }
     
     # El líder (si es honesto) firma su propia propuesta automáticamente
     # Nota: En una red real esto es distinto, pero para simulación ayuda.
-    leader_sig = sign_message(leader_node.signing_key, block.block_hash)
-    pb["approvals"][leader_node.id] = leader_sig
+    leader_sig = sign_message(leader_node.signing_key, pb["digest"])
+    record_approval(pb, leader_node.id, leader_sig)
     
-    pending_id_counter += 1
-    pending_blocks.append(pb)
+    pending_blocks.add(pb)
+    deadlines.schedule(pending_id)
 
-    print(f"[BLOCKCHAIN] Propuesta #{pending_id_counter-1} creada por {leader_node.id}. Hash: {block.block_hash[:10]}...")
+    print(f"[BLOCKCHAIN] Propuesta #{pending_id} creada por {leader_node.id} "
+          f"con {len(txs)} transacciones. Digest: {pb['digest'][:10]}...")
     return pb
 
-def mark_pending_block_failed(pending_id: int):
+def list_pending_blocks(validator_id: str = None):
     """
-    Marca un bloque pendiente como REJECTED.
-    CAMBIO IMPORTANTE: Ahora SÍ lo agrega a la cadena para que quede constancia.
+    Retorna lista limpia para el HTML. Con validator_id, solo las propuestas
+    que ese validador todavía no firmó.
     """
-    pb = next((p for p in pending_blocks if p["id"] == pending_id), None)
-    if pb is None:
-        raise HTTPException(status_code=404, detail="Bloque no encontrado")
-
-    block = pb["block"]
-
-    # Recalcular firmas válidas que tenía hasta el momento
-    valid_signatures = {}
-    for vid, s in pb["approvals"].items():
-        vk = next((v.verify_key for v in validators if v.id == vid), None)
-        if vk and verify_signature(vk, block.block_hash, s):
-            valid_signatures[vid] = s
-
-    collected = len(valid_signatures)
-    
-    # Actualizamos el bloque
-    block.signatures = valid_signatures
-    block.certificate = {
-        "status": "REJECTED",
-        "q_required": q,
-        "q_collected": collected,
-        "reason": "Rechazado manualmente (Demo Fallo Consenso)"
-    }
-
-    # 1. IMPORTANTE: Agregamos el bloque "fallido" a la cadena principal
-    # para que aparezca en el historial /chain
-    chain.add_block(block)
-
-    # 2. Lo sacamos de la lista de pendientes
-    pending_blocks.remove(pb)
-
-    return {
-        "status": "rejected",
-        "message": f"Bloque #{block.index} marcado como REJECTED ({collected}/{q} firmas) y archivado."
-    }
-
-
-def list_pending_blocks():
-    """Retorna lista limpia para el HTML."""
+    entries = pending_blocks.snapshot() if validator_id is None else pending_blocks.unsigned_by(validator_id)
     result = []
-    for pb in pending_blocks:
+    for pb in entries:
         block = pb["block"]
+        approvals = pb["approvals"]     # inmutable (copy on write)
         result.append({
             "id": pb["id"],
-            "index": block.index,
             "stage_name": block.stage_name,
+            "tx_count": len(block.transactions),
             "timestamp": block.timestamp,  # Ahora se verá bonito en la web
             "proposed_by": block.leader,
             "responsible": block.responsible_id,
-            "approvals": list(pb["approvals"].keys()),
-            "approvals_count": len(pb["approvals"]),
-            "quorum_needed": q
+            "approvals": approvals.names(pb["validators"]),
+            "approvals_count": len(approvals),
+            "quorum_needed": pb["validators"].q
         })
     return result
 
 
-def sign_pending_block(pending_id: int, validator_id: str):
-    """Un validador firma un bloque pendiente."""
+async def sign_pending_block(pending_id: int, validator_id: str):
+    """
+    Un validador firma un bloque pendiente. Si se alcanza el quórum, la
+    respuesta se libera solo cuando el bloque es durable (group commit).
+    """
 
     # 1. Buscar el bloque pendiente
-    pb = next((p for p in pending_blocks if p["id"] == pending_id), None)
+    pb = pending_blocks.get(pending_id)
     if pb is None:
         raise HTTPException(status_code=404, detail="Bloque no encontrado")
 
     block = pb["block"]
 
     # 2. Buscar al nodo validador
-    v_node = next((v for v in validators if v.id == validator_id), None)
+    v_node = validators_by_id.get(validator_id)
     if v_node is None:
         raise HTTPException(status_code=400, detail="Validador no encontrado en la red")
 
-    # 3. Evitar doble firma
-    if validator_id in pb["approvals"]:
-        raise HTTPException(status_code=400, detail="Ya has firmado este bloque")
-
-    # 4. Firmar el hash del bloque
-    sig = sign_message(v_node.signing_key, block.block_hash)
-    pb["approvals"][validator_id] = sig
-
-    # 5. Verificar firmas acumuladas (por seguridad)
-    valid_signatures = {}
-    for vid, s in pb["approvals"].items():
-        vk = next((v.verify_key for v in validators if v.id == vid), None)
-        if vk and verify_signature(vk, block.block_hash, s):
-            valid_signatures[vid] = s
-
-    # 6. Chequear Quórum
-    collected = len(valid_signatures)
-    
-    # Actualizamos el estado interno del bloque con las firmas actuales
-    block.signatures = valid_signatures
-    block.certificate = {
-        "status": "PENDING",
-        "q_required": q,
-        "q_collected": collected
-    }
+    # 3. Firmar bajo el lock de la propuesta (evita doble firma y doble
+    #    sellado), en el pool criptográfico para no bloquear el event loop
+    collected = await run_crypto(_approve, pb, v_node)
+    q = pb["validators"].q
 
     if collected >= q:
         # ¡CONSENSO ALCANZADO!
-        print(f"✔ QUÓRUM ALCANZADO ({collected}/{q}). Sellando bloque #{block.index}.")
-        
-        block.certificate["status"] = "ACCEPTED"
-        block.certificate["consensus_timestamp"] = get_current_timestamp()
-        
-        chain.add_block(block)
-        pending_blocks.remove(pb)
+        print(f"✔ QUÓRUM ALCANZADO ({collected}/{q}). Sellando propuesta #{pending_id}.")
+        _raise_failed(await commit_pending([pb]))
         
         return {
             "status": "accepted",
@@ -174,58 +287,104 @@ def sign_pending_block(pending_id: int, validator_id: str):
         "progress": f"{collected}/{q}"
     }
 
-def chain_as_dict():
-    """Serializa toda la cadena para verla en /chain"""
-    # Usamos header_dict + los campos extra que no están en el header
-    out = []
-    for b in chain.chain:
-        data = b.header_dict()
-        # Agregamos manualmente lo que header_dict excluye por seguridad
-        data["hash"] = b.block_hash
-        data["signatures"] = b.signatures
-        data["certificate"] = b.certificate
-        out.append(data)
-    return out
-    
-# block_ops.py
+async def sign_pending_blocks(pending_ids, validator_id: str):
+    """
+    Firma en lote: el validador aprueba varias propuestas en una sola
+    petición. Cada aprobación se registra bajo el lock de su propuesta y los
+    bloques que alcanzan el quórum se sellan juntos en un mismo lote de
+    persistencia.
+    """
+    v_node = validators_by_id.get(validator_id)
+    if v_node is None:
+        raise HTTPException(status_code=400, detail="Validador no encontrado en la red")
 
-# ... (imports y otras funciones siguen igual) ...
+    pbs, skipped, ready = await run_crypto(_approve_many, pending_ids, v_node)
 
-def mark_pending_block_failed(pending_id: int):
+    failed = []
+    if ready:
+        print(f"✔ QUÓRUM ALCANZADO en {len(ready)} propuestas. Sellando en un solo lote.")
+        failed = await commit_pending(ready)
+    failed_ids = {pb["id"] for pb, _ in failed}
+
+    return {
+        "status": "ok",
+        "signed": [pb["id"] for pb in pbs],
+        "skipped": skipped,
+        "accepted": [{"pending_id": pb["id"], "index": pb["block"].index,
+                      "final_hash": pb["block"].block_hash} for pb in ready if pb["id"] not in failed_ids],
+        "failed": [{"pending_id": pb["id"], "error": str(error)} for pb, error in failed],
+    }
+
+
+def _approve_many(pending_ids, v_node):
+    # Ids repetidos, inexistentes, ya firmados o ya decididos se omiten (sin error)
+    pbs, skipped, ready = [], [], []
+    consensus_timestamp = get_current_timestamp()
+    for pid in dict.fromkeys(pending_ids):
+        pb = pending_blocks.get(pid)
+        if pb is None:
+            skipped.append(pid)
+            continue
+        try:
+            collected = _approve(pb, v_node, consensus_timestamp)
+        except HTTPException:
+            skipped.append(pid)
+            continue
+        pbs.append(pb)
+        if collected >= pb["validators"].q:
+            ready.append(pb)
+    return pbs, skipped, ready
+
+
+def resolve_pending_ids(ids=(), desde=None, hasta=None, validator_id=None, todas=False):
+    """
+    Ids a firmar en lote: una lista explícita, un rango [desde, hasta] o
+    todas las propuestas que el validador aún no firmó.
+    """
+    if todas:
+        return [pb["id"] for pb in pending_blocks.unsigned_by(validator_id)]
+    ids = list(ids)
+    if desde is not None or hasta is not None:
+        lo = desde if desde is not None else 0
+        hi = hasta if hasta is not None else float("inf")
+        ids += [pb["id"] for pb in pending_blocks.snapshot() if lo <= pb["id"] <= hi]
+    return ids
+
+
+async def mark_pending_block_failed(pending_id: int):
     """
     Marca un bloque pendiente como REJECTED si no alcanzó el quórum q.
     """
-    pb = next((p for p in pending_blocks if p["id"] == pending_id), None)
+    pb = pending_blocks.get(pending_id)
     if pb is None:
         raise HTTPException(status_code=404, detail="Bloque no encontrado")
 
     block = pb["block"]
+    if not _reject(pb, "Rechazo forzado (Demo)"):
+        raise HTTPException(status_code=409, detail="La propuesta ya fue decidida")
+    collected, q = block.certificate["q_collected"], block.certificate["q_required"]
 
-    # Recalcular firmas válidas
-    valid_signatures = {}
-    for vid, s in pb["approvals"].items():
-        vk = next((v.verify_key for v in validators if v.id == vid), None)
-        if vk and verify_signature(vk, block.block_hash, s):
-            valid_signatures[vid] = s
-
-    collected = len(valid_signatures)
-    block.signatures = valid_signatures
-    block.certificate = {
-        "status": "REJECTED",
-        "q_required": q,
-        "q_collected": collected,
-        "reason": "Rechazo forzado (Demo)"
-    }
-
-    # --- AQUÍ ESTABA EL ERROR ---
-    # Faltaba esta línea para guardar el bloque rechazado en el historial:
-    chain.add_block(block) 
-    # ----------------------------
-
-    # Lo sacamos de la lista de pendientes
-    pending_blocks.remove(pb)
+    # Guardamos el bloque rechazado en el historial y lo sacamos de pendientes
+    _raise_failed(await commit_pending([pb]))
 
     return {
         "status": "rejected",
         "message": f"Bloque #{block.index} marcado como REJECTED ({collected}/{q} firmas)."
     }
+
+
+async def expire_pending_blocks(pending_ids):
+    """
+    Rechaza las propuestas cuyo plazo venció (llamado por el planificador de
+    plazos). Las que ya se sellaron o rechazaron se ignoran; el resto se
+    registra como REJECTED en un solo lote de persistencia.
+    """
+    reason = f"Plazo vencido ({deadlines.ttl_seconds:g}s sin quórum)"
+    pbs = [pb for pb in map(pending_blocks.get, pending_ids)
+           if pb is not None and _reject(pb, reason)]
+    if not pbs:
+        return []
+    failed = {pb["id"] for pb, _ in await commit_pending(pbs)}
+    expired = [pb["id"] for pb in pbs if pb["id"] not in failed]
+    print(f"[PLAZOS] {len(expired)} propuestas vencidas registradas como REJECTED.")
+    return expired
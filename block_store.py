@@ -0,0 +1,558 @@
+# block_store.py
+import os
+import json
+import mmap
+import zlib
+import struct
+import binascii
+import time
+import threading
+import itertools
+from collections import OrderedDict
+from concurrent.futures import Future
+
+from block_log import (encode_record, scan_records, atomic_write, fsync_dir,
+                       RECORD_HEADER, RECORD_TRAILER, RECORD_OVERHEAD)
+
+# ======== FORMATO EN DISCO ========
+# El almacén es un directorio con:
+#   segment_000000.log, segment_000001.log, ...  -> registros de block_log
+#   index.idx                                   -> índice de ancho fijo
+#   meta.json                                   -> formato y checksums de segmentos sellados
+#
+# Entrada del índice (una por altura):
+#   [segmento u32][offset del payload u64][longitud u32][hash del bloque 32B]
+# Las entradas libres (preasignadas) tienen longitud 0, así que el número de
+# bloques se obtiene con una búsqueda binaria sobre el índice mapeado.
+#
+# Recuperación: los segmentos sellados se sincronizaron al rotar y su tamaño y
+# CRC32 quedan en meta.json (escrito con temporal + rename). Al abrir solo se
+# recorre el segmento activo: se valida el CRC de cada registro, se trunca la
+# cola rota y se ajusta el índice. El tiempo de arranque queda acotado por el
+# tamaño de un segmento, no por el largo de la cadena.
+#
+# Solo es cola rota un registro inválido al que no sigue ningún registro
+# válido y que el índice no cubre. Si después hay registros válidos o el
+# índice apunta a él (o más allá), son bloques que ya fueron confirmados: el
+# almacén no se abre (CorruptSegmentError) en lugar de descartarlos.
+
+INDEX_ENTRY = struct.Struct("<IQI32s")
+INDEX_GROW = 4096                       # entradas que se preasignan en cada crecimiento
+SEGMENT_MAX_BYTES = 64 * 1024 * 1024    # tamaño a partir del cual se abre un segmento nuevo
+DEFAULT_CACHE_BLOCKS = 1024             # bloques decodificados que se mantienen en memoria
+GROUP_COMMIT_WINDOW = 0.002             # segundos que se esperan para agrupar commits en un fsync
+
+INDEX_FILENAME = "index.idx"
+META_FILENAME = "meta.json"
+STORE_FORMAT = 1
+
+
+class CorruptSegmentError(Exception):
+    """Un segmento tiene un registro dañado en medio de bloques ya confirmados."""
+
+
+def segment_filename(seg: int) -> str:
+    return f"segment_{seg:06d}.log"
+
+
+class BlockStore:
+    """
+    Almacén segmentado de bloques con índice de offsets mapeado en memoria.
+
+    Leer el bloque N es una consulta al índice y un slice del segmento; solo
+    los últimos bloques usados quedan decodificados en memoria (LRU acotado).
+    Se comporta como una secuencia de solo lectura: len(), [i] e iteración.
+
+    Los segmentos funcionan como write-ahead log con group commit: append()
+    escribe el registro y retorna un Future que se resuelve cuando un fsync
+    lo cubre. Los commits que llegan dentro de la misma ventana comparten
+    un único fsync.
+
+    Concurrencia: hay un solo escritor (append) y los lectores no toman el
+    lock de escritura. Una entrada del índice se escribe antes de publicar el
+    nuevo largo, las alturas ya escritas nunca cambian y los mapas que se
+    reemplazan no se cierran mientras un lector los use (se liberan al perder
+    su última referencia).
+    """
+
+    def __init__(self, directory, decode, cache_blocks=DEFAULT_CACHE_BLOCKS,
+                 segment_max_bytes=SEGMENT_MAX_BYTES, group_commit_window=GROUP_COMMIT_WINDOW):
+        self.directory = directory
+        self.decode = decode
+        self.cache_blocks = cache_blocks
+        self.segment_max_bytes = segment_max_bytes
+        self.group_commit_window = group_commit_window
+
+        self._lock = threading.RLock()
+        self._cache = OrderedDict()     # altura -> Block decodificado
+        self._cache_lock = threading.Lock()
+        self._views = {}                # segmento -> mmap de solo lectura
+        self._count = 0
+        self._capacity = 0
+        self._index_file = None
+        self._index_map = None
+        self._active_seg = 0
+        self._active_file = None
+        self._active_size = 0
+        self._active_crc = 0
+        self._active_records = 0
+        self.meta = {}
+        self.recovery = {}
+
+        self._sync_waiters = []         # Futures esperando el próximo fsync
+        self._sync_requested = threading.Event()
+        self._closing = False
+        self._committer = None
+
+    # --- APERTURA Y CIERRE ---
+
+    def segment_path(self, seg: int) -> str:
+        return os.path.join(self.directory, segment_filename(seg))
+
+    def segments_on_disk(self):
+        segs = []
+        for name in os.listdir(self.directory):
+            if name.startswith("segment_") and name.endswith(".log"):
+                segs.append(int(name[len("segment_"):-len(".log")]))
+        return sorted(segs)
+
+    def open(self):
+        started = time.perf_counter()
+        os.makedirs(self.directory, exist_ok=True)
+        self.meta = self._load_meta()
+
+        index_path = os.path.join(self.directory, INDEX_FILENAME)
+        if not os.path.exists(index_path):
+            open(index_path, "wb").close()
+        self._index_file = open(index_path, "r+b")
+        self._map_index(max(os.path.getsize(index_path) // INDEX_ENTRY.size, INDEX_GROW))
+        self._count = self._find_count()
+
+        segs = self.segments_on_disk() or [0]
+        self._active_seg = segs[-1]
+        self._check_sealed(segs[:-1])
+        reindexed, dropped, truncated = self._recover_tail(segs)
+
+        self._active_file = open(self.segment_path(self._active_seg), "ab")
+        self._active_size = self._active_file.tell()
+
+        self.recovery = {
+            "blocks": self._count,
+            "reindexed": reindexed,
+            "dropped_entries": dropped,
+            "truncated_bytes": truncated,
+            "seconds": round(time.perf_counter() - started, 4),
+        }
+        if reindexed or dropped or truncated:
+            print(f"[RECUPERACIÓN] {truncated} bytes de cola rota truncados, "
+                  f"{reindexed} registros reindexados, {dropped} entradas descartadas.")
+
+        self._closing = False
+        self._committer = threading.Thread(target=self._commit_loop, name="block-store-commit", daemon=True)
+        self._committer.start()
+        return self
+
+    def open_read_only(self):
+        """
+        Abre el almacén solo para lectura (p. ej. desde otro proceso mientras
+        el servidor sigue escribiendo): no hay recuperación ni hilo de commit,
+        y solo se ven los bloques indexados al momento de abrir.
+        """
+        self.meta = self._load_meta()
+        index_path = os.path.join(self.directory, INDEX_FILENAME)
+        self._index_file = open(index_path, "rb")
+        size = os.path.getsize(index_path)
+        self._capacity = size // INDEX_ENTRY.size
+        if self._capacity:
+            self._index_map = mmap.mmap(self._index_file.fileno(), size, access=mmap.ACCESS_READ)
+        self._count = self._find_count()
+        return self
+
+    def refresh(self, count=None):
+        """
+        Solo lectura: adopta los bloques que el proceso escritor agregó desde
+        la apertura. count es el largo publicado por el escritor (todas esas
+        entradas ya están completas); sin él se busca en el índice.
+        """
+        size = os.path.getsize(self._index_file.name)
+        if size // INDEX_ENTRY.size > self._capacity:
+            self._index_map = mmap.mmap(self._index_file.fileno(), size, access=mmap.ACCESS_READ)
+            self._capacity = size // INDEX_ENTRY.size
+        self._count = self._find_count() if count is None else min(count, self._capacity)
+        return self._count
+
+    def close(self):
+        if self._committer is not None:
+            self._closing = True
+            self._sync_requested.set()
+            self._committer.join()
+            self._committer = None
+        with self._lock:
+            for view in self._views.values():
+                view.close()
+            self._views.clear()
+            if self._index_map is not None:
+                self._index_map.close()
+                self._index_map = None
+            if self._index_file is not None:
+                self._index_file.close()
+                self._index_file = None
+            if self._active_file is not None:
+                self._active_file.close()
+                self._active_file = None
+
+    # --- ÍNDICE ---
+
+    def _map_index(self, capacity):
+        # El mapa anterior no se cierra: un lector concurrente puede estar
+        # usándolo y se libera solo al perder su última referencia.
+        # En Windows no se puede cambiar el tamaño de un archivo con vistas
+        # abiertas (WinError 1224); ahí el mapa más grande extiende el archivo
+        # por sí mismo, así que solo se trunca antes de que exista una vista.
+        size = capacity * INDEX_ENTRY.size
+        if os.path.getsize(self._index_file.name) < size and (self._index_map is None or os.name != "nt"):
+            self._index_file.truncate(size)
+        self._index_map = mmap.mmap(self._index_file.fileno(), size)
+        self._capacity = capacity
+
+    def _entry(self, height):
+        return INDEX_ENTRY.unpack_from(self._index_map, height * INDEX_ENTRY.size)
+
+    def _find_count(self):
+        # Las entradas válidas forman un prefijo: buscamos la primera libre.
+        lo, hi = 0, self._capacity
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._entry(mid)[2] != 0:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def _write_entry(self, seg, offset, length, block_hash_hex):
+        if self._count == self._capacity:
+            self._map_index(self._capacity + INDEX_GROW)
+        INDEX_ENTRY.pack_into(
+            self._index_map, self._count * INDEX_ENTRY.size,
+            seg, offset, length, binascii.unhexlify(block_hash_hex)
+        )
+        self._count += 1
+
+    def _truncate_index(self, count):
+        """Descarta las entradas del índice a partir de la altura count."""
+        start, end = count * INDEX_ENTRY.size, self._count * INDEX_ENTRY.size
+        self._index_map[start:end] = bytes(end - start)
+        self._count = count
+
+    def _first_height_in(self, seg):
+        # Los números de segmento del índice no decrecen: búsqueda binaria.
+        lo, hi = 0, self._count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._entry(mid)[0] < seg:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    # --- RECUPERACIÓN ---
+
+    def _load_meta(self):
+        path = os.path.join(self.directory, META_FILENAME)
+        if os.path.exists(path):
+            with open(path, "r") as f:
+                return json.load(f)
+        return {"format": STORE_FORMAT, "segments": {}}
+
+    def _save_meta(self):
+        data = json.dumps(self.meta, indent=2).encode()
+        atomic_write(os.path.join(self.directory, META_FILENAME), data)
+
+    def _check_sealed(self, sealed):
+        """Compara los segmentos sellados con el tamaño registrado en meta.json."""
+        changed = False
+        for seg in sealed:
+            info = self.meta["segments"].get(str(seg))
+            size = os.path.getsize(self.segment_path(seg))
+            if info is None:
+                # Segmento anterior a meta.json: se registra una sola vez
+                with open(self.segment_path(seg), "rb") as f:
+                    crc = zlib.crc32(f.read())
+                self.meta["segments"][str(seg)] = {"bytes": size, "crc32": crc}
+                changed = True
+            elif info["bytes"] != size:
+                print(f"[ERROR] El segmento sellado {seg} cambió de tamaño "
+                      f"({info['bytes']} -> {size} bytes); ejecute una verificación completa.")
+        if changed:
+            self._save_meta()
+
+    def _scan_segment(self, seg):
+        """
+        Recorre un segmento validando el CRC de cada registro y lo concilia con
+        el índice: indexa los registros que el índice no conoce y, si una
+        entrada no coincide con el registro, reconstruye el índice desde ahí.
+        Retorna (registros reindexados, fin de la parte válida, crc32 de esa parte).
+        Lanza CorruptSegmentError si lo que sigue a la parte válida no es una
+        cola rota.
+        """
+        height = self._first_height_in(seg)
+        reindexed = 0
+        good_end = 0
+        with open(self.segment_path(seg), "rb") as f:
+            for offset, payload in scan_records(f):
+                entry = (seg, offset + RECORD_HEADER.size, len(payload))
+                if height < self._count and self._entry(height)[:3] != entry:
+                    self._truncate_index(height)
+                if height >= self._count:
+                    block = self.decode(payload)
+                    self._write_entry(seg, entry[1], entry[2], block.block_hash)
+                    reindexed += 1
+                height += 1
+                good_end = f.tell()
+            f.seek(0)
+            crc = zlib.crc32(f.read(good_end))
+            size = f.seek(0, os.SEEK_END)
+        if good_end < size:
+            self._check_torn_tail(seg, height, good_end)
+        return reindexed, good_end, crc
+
+    def _check_torn_tail(self, seg, height, good_end):
+        """
+        El registro de la altura height (offset good_end) es inválido. Solo se
+        acepta como cola rota del segmento activo si el índice no lo cubre y
+        no hay ningún registro válido después; si no, se lanza CorruptSegmentError.
+        """
+        path = self.segment_path(seg)
+        if seg != self._active_seg:
+            reason = "el segmento ya estaba sellado"
+        elif self._count > height and self._entry(height)[0] == seg:
+            reason = f"el índice tiene {self._count - height} bloques desde ahí"
+        elif self._valid_record_after(path, good_end):
+            reason = "hay registros válidos después"
+        else:
+            return
+        raise CorruptSegmentError(
+            f"Registro inválido en {path} (offset {good_end}, altura {height}) y {reason}: "
+            f"no se descartan bloques confirmados. Restaure el segmento desde una copia.")
+
+    @staticmethod
+    def _valid_record_after(path, start):
+        """¿Hay algún registro válido (no vacío) después del offset start?"""
+        with open(path, "rb") as f:
+            f.seek(start)
+            data = f.read()
+        # Primero donde empezaría el siguiente registro si solo se dañó el
+        # payload; después byte a byte (solo se llega aquí tras un error).
+        first = RECORD_OVERHEAD + RECORD_HEADER.unpack_from(data, 0)[0] if len(data) >= RECORD_HEADER.size else 0
+        for pos in itertools.chain((first,), range(1, len(data) - RECORD_OVERHEAD + 1)):
+            if pos + RECORD_OVERHEAD > len(data):
+                continue
+            (n,) = RECORD_HEADER.unpack_from(data, pos)
+            end = pos + RECORD_HEADER.size + n
+            if n == 0 or end + RECORD_TRAILER.size > len(data):
+                continue
+            n2, crc = RECORD_TRAILER.unpack_from(data, end)
+            if n2 == n and crc == zlib.crc32(data[pos + RECORD_HEADER.size:end]):
+                return True
+        return False
+
+    def _recover_tail(self, segs):
+        """
+        Concilia el índice con los segmentos desde el último indexado hasta el
+        activo (normalmente solo el activo) y trunca la cola rota de este.
+        Retorna (reindexados, entradas descartadas, bytes truncados).
+        """
+        indexed = self._count
+        start_seg = self._entry(self._count - 1)[0] if self._count else segs[0]
+        reindexed = truncated = 0
+        for seg in segs:
+            if seg < start_seg:
+                continue
+            path = self.segment_path(seg)
+            if not os.path.exists(path):
+                open(path, "wb").close()
+            n, good_end, crc = self._scan_segment(seg)
+            reindexed += n
+            size = os.path.getsize(path)
+            if seg != self._active_seg:
+                continue
+            truncated = size - good_end
+            if truncated:
+                with open(path, "r+b") as f:
+                    f.truncate(good_end)
+                    os.fsync(f.fileno())
+            self._active_crc = crc
+            self._active_records = self._count - self._first_height_in(seg)
+        dropped = indexed - (self._count - reindexed)
+        return reindexed, dropped, truncated
+
+    # --- ESCRITURA (WAL CON GROUP COMMIT) ---
+
+    def append(self, payload: bytes, block_hash_hex: str, block=None) -> Future:
+        """
+        Agrega un bloque ya serializado. Retorna un Future con su altura que
+        se resuelve solo cuando el registro es durable (después del fsync).
+        """
+        record = encode_record(payload)
+        durable = Future()
+        with self._lock:
+            if self._active_size > 0 and self._active_size + len(record) > self.segment_max_bytes:
+                self._roll_segment()
+            offset = self._active_size + RECORD_HEADER.size
+            self._active_file.write(record)
+            self._active_file.flush()
+            self._active_size += len(record)
+            self._active_crc = zlib.crc32(record, self._active_crc)
+            self._active_records += 1
+
+            height = self._count
+            self._write_entry(self._active_seg, offset, len(payload), block_hash_hex)
+            if block is not None:
+                with self._cache_lock:
+                    self._cache_put(height, block)
+
+            self._sync_waiters.append((durable, height))
+            self._sync_requested.set()
+        return durable
+
+    def _roll_segment(self):
+        # El segmento que se cierra se sincroniza aquí; el hilo de commit
+        # solo sincroniza el segmento activo.
+        self._active_file.flush()
+        os.fsync(self._active_file.fileno())
+        self._active_file.close()
+        self.meta["segments"][str(self._active_seg)] = {
+            "bytes": self._active_size,
+            "crc32": self._active_crc,
+            "records": self._active_records,
+        }
+        self._save_meta()
+
+        self._active_seg += 1
+        self._active_file = open(self.segment_path(self._active_seg), "ab")
+        self._active_size = 0
+        self._active_crc = 0
+        self._active_records = 0
+        fsync_dir(self.directory)
+
+    def _commit_loop(self):
+        while True:
+            self._sync_requested.wait()
+            if not self._closing:
+                # Ventana de agrupación: los commits concurrentes se suman al lote
+                time.sleep(self.group_commit_window)
+            with self._lock:
+                self._sync_requested.clear()
+                waiters, self._sync_waiters = self._sync_waiters, []
+                # dup() permite hacer fsync fuera del lock aunque el segmento rote
+                fd = os.dup(self._active_file.fileno()) if waiters else None
+            if fd is not None:
+                try:
+                    os.fsync(fd)
+                    for fut, height in waiters:
+                        fut.set_result(height)
+                except Exception as e:
+                    for fut, _ in waiters:
+                        fut.set_exception(e)
+                finally:
+                    os.close(fd)
+            if self._closing and not self._sync_waiters:
+                return
+
+    # --- LECTURA ---
+
+    def __len__(self):
+        return self._count
+
+    def block_hash(self, height) -> str:
+        """Hash del bloque directamente desde el índice, sin decodificarlo."""
+        if height < 0:
+            height += self._count
+        return binascii.hexlify(self._entry(height)[3]).decode()
+
+    def index_entry(self, height) -> bytes:
+        """Bytes crudos de la entrada del índice (segmento, offset, longitud, hash)."""
+        start = height * INDEX_ENTRY.size
+        return bytes(self._index_map[start:start + INDEX_ENTRY.size])
+
+    def segment_of(self, height) -> int:
+        return self._entry(height)[0]
+
+    def record_end(self, height) -> int:
+        """Offset en su segmento donde termina el registro del bloque height."""
+        _, offset, length, _ = self._entry(height)
+        return offset + length + RECORD_TRAILER.size
+
+    def read_payload(self, height) -> bytes:
+        seg, offset, length, _ = self._entry(height)
+        end = offset + length
+        view = self._views.get(seg)
+        if view is None or len(view) < end:
+            # Igual que el índice: la vista anterior se libera sola
+            with open(self.segment_path(seg), "rb") as f:
+                view = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            self._views[seg] = view
+        return view[offset:end]
+
+    def read_block(self, height):
+        """Decodifica el bloque sin pasar por la caché (recorridos secuenciales)."""
+        return self.decode(self.read_payload(height))
+
+    def __getitem__(self, height):
+        count = self._count
+        if height < 0:
+            height += count
+        if not 0 <= height < count:
+            raise IndexError("altura fuera de rango")
+        with self._cache_lock:
+            block = self._cache.get(height)
+            if block is not None:
+                self._cache.move_to_end(height)
+                return block
+        block = self.decode(self.read_payload(height))
+        with self._cache_lock:
+            self._cache_put(height, block)
+        return block
+
+    def __iter__(self):
+        return iter(self.snapshot())
+
+    def snapshot(self):
+        """Vista inmutable de las alturas existentes en este momento."""
+        return StoreSnapshot(self, self._count)
+
+    def _cache_put(self, height, block):
+        self._cache[height] = block
+        self._cache.move_to_end(height)
+        while len(self._cache) > self.cache_blocks:
+            self._cache.popitem(last=False)
+
+
+class StoreSnapshot:
+    """
+    Cadena congelada en un largo fijo: los bloques que se agreguen después no
+    aparecen, así un lector ve siempre un prefijo consistente sin tomar locks.
+    """
+
+    def __init__(self, store, count):
+        self._store = store
+        self._count = count
+
+    def __len__(self):
+        return self._count
+
+    def __getitem__(self, height):
+        if height < 0:
+            height += self._count
+        if not 0 <= height < self._count:
+            raise IndexError("altura fuera de rango")
+        return self._store[height]
+
+    def __iter__(self):
+        for height in range(self._count):
+            yield self._store[height]
+
+    def block_hash(self, height) -> str:
+        if height < 0:
+            height += self._count
+        return self._store.block_hash(height)
@@ -1,17 +1,29 @@
 # blockchain.py
-import hashlib
-import json
 import binascii
 import os  # Necesario para verificar si el archivo existe
 from dataclasses import dataclass, field
+import bisect
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
 from typing import List, Dict, Any
 from datetime import datetime
 from nacl.signing import SigningKey, VerifyKey
+from block_log import migrate_json_chain, fsync_dir
+from block_store import BlockStore
+from chain_index import ChainIndex
+from json_cache import block_json
+import codec
+import hashing
+from quorum import ValidatorSet
 
 # ======== HELPERS ========
 
+TIMESTAMP_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+
 def get_current_timestamp():
-    return datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    return datetime.now().strftime(TIMESTAMP_FORMAT)
 
 # ======== DATA CLASSES ========
 
@@ -46,9 +58,13 @@ class Block:
     signatures: Dict[str, str] = field(default_factory=dict)
     certificate: Dict[str, Any] = field(default_factory=dict)
     block_hash: str = ""
+    # Versión de la codificación de cabecera usada para block_hash (ver hashing.py)
+    hash_version: int = hashing.CURRENT_HASH_VERSION
+    # Nonce aleatorio de la propuesta (hex); entra en el digest desde la versión 5
+    nonce: str = ""
 
     def header_dict(self):
-        """Datos inmutables para el hash."""
+        """Datos inmutables para el hash (en la versión 1, la entrada del JSON hasheado)."""
         return {
             "index": self.index,
             "previous_hash": self.previous_hash,
@@ -60,10 +76,21 @@ class Block:
         }
 
     def compute_hash(self):
-        block_string = json.dumps(self.header_dict(), sort_keys=True).encode()
-        self.block_hash = hashlib.sha256(block_string).hexdigest()
+        self.block_hash = hashing.header_hash(self)
         return self.block_hash
 
+    def verify_hash(self):
+        """Recalcula el hash con la versión con la que se selló el bloque."""
+        return hashing.verify_header_hash(self)
+
+    def signing_message(self):
+        """Lo que firman los validadores (desde la versión 4, independiente de la altura)."""
+        return hashing.signing_message(self)
+
+    def seal_message(self):
+        """Lo que firma el líder al sellar un bloque versión 4 o 5 (altura y padre incluidos)."""
+        return hashing.seal_message(self)
+
     # --- NUEVOS MÉTODOS PARA PERSISTENCIA ---
     
     def to_dict(self):
@@ -73,6 +100,9 @@ class Block:
         data["hash"] = self.block_hash
         data["signatures"] = self.signatures
         data["certificate"] = self.certificate
+        data["hash_version"] = self.hash_version
+        if self.hash_version >= hashing.HASH_V5_NONCE:
+            data["nonce"] = self.nonce
         return data
 
     @classmethod
@@ -90,6 +120,9 @@ class Block:
         block.block_hash = data.get("hash", "")
         block.signatures = data.get("signatures", {})
         block.certificate = data.get("certificate", {})
+        # Los bloques guardados antes de la cabecera canónica usan la versión 1
+        block.hash_version = data.get("hash_version", hashing.HASH_V1_JSON)
+        block.nonce = data.get("nonce", "")
         return block
 
 
@@ -148,14 +181,170 @@ def verify_signature(vk, msg, sig_hex):
         return False
 
 
+class SignatureCache:
+    """
+    Caché LRU acotada de verificaciones Ed25519, con clave
+    (validador, mensaje, firma). Evita repetir la verificación de una firma
+    que ya se comprobó (p. ej. al recontar aprobaciones de un bloque).
+    """
+
+    def __init__(self, maxsize=65536):
+        self.maxsize = maxsize
+        self._results = OrderedDict()
+        self._lock = threading.Lock()
+
+    def verify(self, validator_id, vk, msg, sig_hex):
+        key = (validator_id, msg, sig_hex)
+        with self._lock:
+            ok = self._results.get(key)
+            if ok is not None:
+                self._results.move_to_end(key)
+                return ok
+        ok = verify_signature(vk, msg, sig_hex)
+        with self._lock:
+            self._results[key] = ok
+            if len(self._results) > self.maxsize:
+                self._results.popitem(last=False)
+        return ok
+
+
+# ======== VERIFICACIÓN DE BLOQUES ========
+
+GENESIS_PREVIOUS_HASH = "0" * 64
+
+
+class EpochKeys:
+    """
+    Conjuntos de validadores por época: la época i rige desde la altura
+    starts[i] hasta el inicio de la siguiente. Cada bloque se verifica con el
+    conjunto (claves y umbral q) de su época, así los certificados históricos
+    siguen siendo verificables después de rotar claves o cambiar el número de
+    validadores. Las VerifyKey se decodifican una sola vez al construir la tabla.
+    """
+
+    def __init__(self, epochs):
+        # epochs: lista de (altura de inicio, {validator_id: clave pública hex});
+        # el orden de las claves es el de los bits de aprobación.
+        epochs = sorted(epochs, key=lambda e: e[0])
+        self.starts = [start for start, _ in epochs]
+        self.keys_hex = [dict(keys) for _, keys in epochs]
+        self._sets = [
+            ValidatorSet(list(keys), [VerifyKey(bytes.fromhex(h)) for h in keys.values()],
+                         threshold_q(len(keys)), epoch=i, from_height=start)
+            for i, (start, keys) in enumerate(zip(self.starts, self.keys_hex))
+        ]
+
+    @classmethod
+    def single(cls, validators):
+        """Una sola época desde la altura 0 con las claves actuales."""
+        return cls([(0, {v.id: v.public_hex() for v in validators})])
+
+    @classmethod
+    def from_json(cls, data):
+        """Acepta {"epochs": [...]} (keystore), una lista de épocas o {vid: hex} (una época)."""
+        if isinstance(data, dict) and "epochs" in data:
+            data = data["epochs"]
+        if isinstance(data, dict):
+            return cls([(0, data)])
+        return cls([(e["from_height"], e["keys"]) for e in data])
+
+    def to_json(self):
+        return [{"from_height": start, "keys": keys} for start, keys in zip(self.starts, self.keys_hex)]
+
+    def for_height(self, height) -> ValidatorSet:
+        """Conjunto de validadores vigente en la altura dada (vacío antes de la primera época)."""
+        i = bisect.bisect_right(self.starts, height) - 1
+        return self._sets[i] if i >= 0 else ValidatorSet([], [], 0, epoch=-1)
+
+    def latest(self) -> ValidatorSet:
+        return self._sets[-1] if self._sets else ValidatorSet([], [], 0, epoch=-1)
+
+
+def verify_block(b: Block, height: int, verify_keys, q, message=None):
+    """
+    Verifica un bloque de forma aislada: altura, hash recalculado y
+    certificado (firmas Ed25519 contra el quórum). verify_keys es el
+    ValidatorSet de la época del bloque (o un dict validator_id -> VerifyKey);
+    si es None se omiten las firmas. q es el umbral mínimo que debe declarar
+    el certificado. message es b.signing_message() si el llamador ya lo
+    calculó. Retorna la lista de errores encontrados.
+    """
+    errors = []
+    if b.index != height:
+        errors.append(f"index {b.index} no coincide con la altura")
+    if not b.verify_hash():
+        errors.append("hash recalculado no coincide")
+
+    status = b.certificate.get("status")
+    if height == 0:
+        if status != "GENESIS" or b.previous_hash != GENESIS_PREVIOUS_HASH:
+            errors.append("génesis inválido")
+        return errors
+    if status not in ("ACCEPTED", "REJECTED"):
+        errors.append(f"estado de certificado inválido: {status}")
+        return errors
+    if verify_keys is None:
+        return errors
+
+    if b.hash_version >= hashing.HASH_V4_PIPELINED:
+        # Sello del líder sobre la cabecera final (altura y padre)
+        seal = b.certificate.get("seal")
+        leader_key = verify_keys.get(b.leader)
+        if not seal:
+            errors.append("bloque sin sello del líder")
+        elif leader_key is None:
+            errors.append(f"sello de un líder desconocido {b.leader}")
+        elif not verify_signature(leader_key, b.seal_message(), seal):
+            errors.append("sello del líder inválido")
+
+    valid = 0
+    if message is None:
+        message = b.signing_message()
+    for vid, sig in b.signatures.items():
+        vk = verify_keys.get(vid)
+        if vk is None:
+            errors.append(f"firma de validador desconocido {vid}")
+        elif verify_signature(vk, message, sig):
+            valid += 1
+        else:
+            errors.append(f"firma inválida de {vid}")
+    required = b.certificate.get("q_required", q)
+    if q is not None and required < q:
+        errors.append(f"q_required {required} menor que el umbral de la época ({q})")
+    if status == "ACCEPTED" and valid < required:
+        errors.append(f"quórum insuficiente ({valid}/{required})")
+    if b.certificate.get("q_collected", valid) != valid:
+        errors.append("q_collected no coincide con las firmas válidas")
+    return errors
+
+
 # ======== BLOCKCHAIN CLASS CON PERSISTENCIA ========
 
+class SealError(Exception):
+    """El bloque no se pudo sellar ni escribir: la cadena no cambió."""
+
+
 class SimpleBlockchain:
-    def __init__(self, validators, q, filename="blockchain_data.json"):
-        self.chain: List[Block] = []
+    def __init__(self, validators, q, directory="blockchain_data",
+                 legacy_log="blockchain_data.log", legacy_json="blockchain_data.json", key_epochs=None):
         self.validators = validators
         self.q = q
-        self.filename = filename
+        # Claves públicas por época (keystore); sin ellas, las claves actuales
+        self.key_epochs = key_epochs
+        self.directory = directory
+        self.legacy_log = legacy_log
+        self.legacy_json = legacy_json
+        # La cadena vive en disco; self.chain es una vista tipo secuencia
+        # (len, [i], iteración) que decodifica bloques bajo demanda.
+        self.chain = BlockStore(directory, decode=self.decode_block)
+        # IDs de validadores internados por el codec binario
+        self.ids = codec.IdTable(os.path.join(directory, "ids.json"))
+        # Índices secundarios (lote, etapa, responsable, emisor)
+        self.index = ChainIndex(directory)
+        # Serializa la asignación de altura/padre con el append al almacén
+        self._seal_lock = threading.Lock()
+        # Claves con las que cada líder sella sus bloques
+        self._leader_keys = {v.id: v.signing_key for v in validators}
 
     def genesis(self):
         b = Block(
@@ -169,49 +358,156 @@ class SimpleBlockchain:
         )
         b.compute_hash()
         b.certificate = {"status": "GENESIS", "consensus": True}
-        self.chain.append(b)
-        self.save_chain() # Guardar el génesis
+        self.save_block(b).result() # Guardar el génesis (esperamos a que sea durable)
 
     def last_hash(self):
-        return self.chain[-1].block_hash
-
-    def add_block(self, b: Block):
-        self.chain.append(b)
-        self.save_chain() # <--- GUARDADO AUTOMÁTICO
+        # Se lee del índice, sin decodificar el último bloque
+        return self.chain.block_hash(-1)
+
+    def add_blocks(self, blocks):
+        """
+        Sella varios bloques en alturas consecutivas dentro de un mismo lote
+        de persistencia (comparten el fsync del group commit). Retorna un
+        Future por bloque, que se resuelve cuando ese bloque es durable; el de
+        un bloque que no se pudo escribir falla con SealError y los demás
+        siguen sellándose a continuación.
+
+        En la versión 4 la altura y el padre se asignan aquí, al momento del
+        commit, y no al proponer: las propuestas en consenso simultáneo se
+        encadenan en el orden en que alcanzan su decisión.
+        """
+        durables = []
+        with self._seal_lock:
+            for b in blocks:
+                try:
+                    durables.append(self._seal_and_save(b))
+                except Exception as e:
+                    failed = Future()
+                    failed.set_exception(SealError(str(e)))
+                    durables.append(failed)
+        return durables
+
+    def _seal_and_save(self, b: Block):
+        if b.hash_version >= hashing.HASH_V4_PIPELINED:
+            leader_key = self._leader_keys.get(b.leader)
+            if leader_key is None:
+                raise ValueError(f"No hay clave del líder {b.leader} para sellar el bloque")
+            b.index = len(self.chain)
+            b.previous_hash = self.last_hash()
+            b.compute_hash()
+            b.certificate = {**b.certificate, "seal": sign_message(leader_key, b.seal_message())}
+        elif b.index != len(self.chain) or b.previous_hash != self.last_hash():
+            raise ValueError(f"El bloque #{b.index} no enlaza con la punta de la cadena")
+        return self.save_block(b) # <--- GUARDADO AUTOMÁTICO (solo el bloque nuevo)
+
+    def snapshot(self):
+        """Vista inmutable de la cadena actual para lectores concurrentes."""
+        return self.chain.snapshot()
+
+    def verify_keys(self) -> EpochKeys:
+        if self.key_epochs is not None:
+            return self.key_epochs
+        return EpochKeys.single(self.validators)
+
+    def verify(self, workers=None, progress=None):
+        """Verificación completa (hashes, certificados y enlaces) en paralelo."""
+        from verify import verify_chain
+        return verify_chain(self, workers=workers, progress=progress)
+
+    def verify_incremental(self, workers=None):
+        """Verifica solo los bloques añadidos desde la última marca de verificación."""
+        from verify import verify_incremental
+        report = verify_incremental(self, workers=workers)
+        if report.blocks:
+            print(f"[VERIFICACIÓN] {report.blocks} bloques nuevos verificados desde la altura "
+                  f"{report.start} en {report.seconds:.3f}s, {len(report.errors)} errores.")
+        if report.unkeyed:
+            print(f"[VERIFICACIÓN] Nota: {report.unkeyed} bloques son anteriores a la primera época "
+                  f"del keystore; sus firmas no se pueden verificar (solo hashes y enlaces).")
+        for height, msg in report.errors[:10]:
+            print(f"[VERIFICACIÓN]   bloque #{height}: {msg}")
+        if report.known_errors:
+            heights = sorted({h for h, _ in report.known_errors})
+            print(f"[VERIFICACIÓN] {len(report.known_errors)} errores ya registrados en verified.json "
+                  f"(alturas {heights[0]}..{heights[-1]}); ejecute verify.py para el detalle.")
+        return report
 
     def is_valid(self):
-        for i in range(1, len(self.chain)):
-            if self.chain[i].previous_hash != self.chain[i - 1].block_hash:
-                return False
-        return True
+        return self.verify().ok
 
     # --- MÉTODOS DE GUARDADO Y CARGA ---
 
-    def save_chain(self):
-        """Guarda toda la cadena en un archivo JSON."""
+    def encode_block(self, b: Block) -> bytes:
+        return codec.encode_block(b, self.ids)
+
+    def decode_block(self, payload: bytes) -> Block:
+        # Acepta tanto registros binarios como los JSON de versiones anteriores
+        return Block.from_dict(codec.decode_record(payload, self.ids))
+
+    def save_block(self, b: Block):
+        """Agrega solo el registro del bloque al almacén (O(1) por commit)."""
         try:
-            data = [b.to_dict() for b in self.chain]
-            with open(self.filename, 'w') as f:
-                json.dump(data, f, indent=4)
-            print(f"[PERSISTENCIA] Cadena guardada en {self.filename} ({len(self.chain)} bloques)")
+            durable = self.chain.append(self.encode_block(b), b.block_hash, block=b)
         except Exception as e:
-            print(f"[ERROR] No se pudo guardar la blockchain: {e}")
-
-    def load_chain(self):
-        """Intenta cargar la cadena desde el archivo JSON. Retorna True si tuvo éxito."""
-        if not os.path.exists(self.filename):
-            return False
-        
+            print(f"[ERROR] No se pudo guardar el bloque #{b.index}: {e}")
+            raise
+        # El bloque ya está en la cadena: un fallo de las cachés no lo deshace
+        # (catch_up y la primera lectura las completan)
         try:
-            with open(self.filename, 'r') as f:
-                data = json.load(f)
-            
-            if not data:
-                return False
-
-            self.chain = [Block.from_dict(b_data) for b_data in data]
-            print(f"[PERSISTENCIA] Cadena cargada exitosamente: {len(self.chain)} bloques recuperados.")
-            return True
+            self.index.add_block(b)
+            block_json.add_block(b)     # los lectores lo servirán sin re-serializarlo
         except Exception as e:
-            print(f"[ERROR] Archivo corrupto o ilegible, se iniciará una cadena nueva: {e}")
+            print(f"[ERROR] Bloque #{b.index} guardado, pero no se pudo indexar: {e}")
+        print(f"[PERSISTENCIA] Bloque #{b.index} agregado a {self.directory} ({len(self.chain)} bloques)")
+        return durable
+
+    def _migrate_legacy(self):
+        """
+        Convierte una sola vez los formatos anteriores al almacén segmentado.
+        El primer segmento se arma en un directorio temporal y se mueve al
+        almacén al final, así un corte a mitad de camino no deja un almacén
+        vacío que el siguiente arranque confundiría con una cadena nueva: la
+        migración se repite (o se completa) mientras el almacén no tenga segmentos.
+        """
+        if os.path.isdir(self.directory) and self.chain.segments_on_disk():
+            return
+        tmp = self.directory + ".migrating"
+        tmp_segment = os.path.join(tmp, os.path.basename(self.chain.segment_path(0)))
+        if os.path.exists(self.legacy_log):
+            os.makedirs(tmp, exist_ok=True)
+            os.replace(self.legacy_log, tmp_segment)
+            fsync_dir(tmp)
+            print(f"[PERSISTENCIA] Log {self.legacy_log} movido a {tmp_segment}")
+        elif os.path.exists(self.legacy_json):
+            os.makedirs(tmp, exist_ok=True)
+            migrate_json_chain(self.legacy_json, tmp_segment)
+        elif not os.path.exists(tmp_segment):
+            return
+        # Se llega aquí también si un arranque anterior se cortó antes de este paso
+        os.makedirs(self.directory, exist_ok=True)
+        first_segment = self.chain.segment_path(0)
+        os.replace(tmp_segment, first_segment)
+        fsync_dir(self.directory)
+        os.rmdir(tmp)
+        print(f"[PERSISTENCIA] Migración completada en {first_segment}")
+
+    def load_chain(self):
+        """
+        Abre el almacén de bloques. Retorna True si ya contenía una cadena.
+        Una cola rota se trunca hasta el último registro válido; un registro
+        dañado entre bloques confirmados (CorruptSegmentError) o cualquier otro
+        error se propaga en lugar de reemplazar la historia por un génesis.
+        """
+        self._migrate_legacy()
+        os.makedirs(self.directory, exist_ok=True)
+        self.ids.load()
+        for v in self.validators:
+            self.ids.intern(v.id)
+        self.chain.open()
+        self.index.open(self.chain)
+        rec = self.chain.recovery
+        if len(self.chain) == 0:
             return False
+        print(f"[PERSISTENCIA] Cadena cargada exitosamente: {rec['blocks']} bloques recuperados "
+              f"en {rec['seconds']:.3f}s.")
+        return True
@@ -0,0 +1,237 @@
+# chain_index.py
+import os
+import json
+import bisect
+import threading
+from array import array
+from datetime import datetime
+
+from block_log import encode_record, scan_records
+
+# ======== ÍNDICES SECUNDARIOS DE TRAZABILIDAD ========
+# Para cada campo indexado se guarda valor -> lista de (altura, nº de tx) en
+# orden de altura. Consultar un lote o un responsable cuesta O(resultados),
+# sin recorrer la cadena.
+#
+#   batch        payload["batch"] de la transacción
+#   stage        payload["stage"] de la transacción, o stage_name del bloque
+#   responsible  responsible_id de la transacción, o el del bloque
+#   sender       sender de la transacción
+#
+# Persistencia: postings.log, junto al almacén, con un registro por bloque
+# (mismo formato con CRC que los segmentos). Es solo una caché de la cadena:
+# no se sincroniza con fsync y, al abrirlo, se descarta desde el primer
+# registro truncado o que no coincida con el hash del bloque en el almacén.
+# Se carga en un hilo de fondo (o en la primera consulta, si llega antes), no
+# al abrir la cadena, para que el arranque no dependa del largo de la cadena.
+# Lo que falte se reconstruye desde el log de bloques en la primera consulta.
+#
+# Índice de tiempo: las marcas de tiempo de bloques y transacciones se
+# guardan como segundos epoch (enteros) en arreglos paralelos ordenados por
+# (tiempo, altura, nº de tx). Un rango [desde, hasta] se ubica con bisección.
+# Con el sellado en paralelo un bloque puede llegar con una marca anterior a
+# la de la punta, así que se inserta en su posición (casi siempre al final).
+
+INDEX_FIELDS = ("batch", "stage", "responsible", "sender")
+POSTINGS_FILENAME = "postings.log"
+
+
+def index_entries(block):
+    """[(campo, valor, nº de tx)] que aporta un bloque a los índices."""
+    entries = []
+    for i, tx in enumerate(block.transactions):
+        payload = tx.get("payload") or {}
+        values = (
+            payload.get("batch"),
+            payload.get("stage") or block.stage_name,
+            tx.get("responsible_id") or block.responsible_id,
+            tx.get("sender"),
+        )
+        for field, value in zip(INDEX_FIELDS, values):
+            if value not in (None, ""):
+                entries.append((field, str(value), i))
+    return entries
+
+
+def parse_timestamp(value):
+    """Marca de tiempo de la cadena ("%Y-%m-%d %H:%M:%S", hora local) a segundos epoch."""
+    from blockchain import TIMESTAMP_FORMAT
+    try:
+        return int(datetime.strptime(value, TIMESTAMP_FORMAT).timestamp())
+    except (TypeError, ValueError):
+        return None
+
+
+def time_entries(block):
+    """(tiempo del bloque, [tiempo de cada tx]) en segundos epoch; None si no se puede leer."""
+    return parse_timestamp(block.timestamp), [parse_timestamp(tx.get("timestamp")) for tx in block.transactions]
+
+
+class TimeSeries:
+    """Arreglos paralelos (tiempo, altura, nº de tx) ordenados, con inserción ordenada."""
+
+    def __init__(self):
+        self.times = array("q")
+        self.heights = array("q")
+        self.txs = array("l")
+
+    def __len__(self):
+        return len(self.times)
+
+    def add(self, ts, height, tx_index=0):
+        # La altura nueva es la mayor: va al final de las entradas con el mismo tiempo
+        i = bisect.bisect_right(self.times, ts)
+        self.times.insert(i, ts)
+        self.heights.insert(i, height)
+        self.txs.insert(i, tx_index)
+
+    def seek(self, ts, height, tx_index):
+        """Primera posición estrictamente posterior a (ts, height, tx_index)."""
+        lo = bisect.bisect_left(self.times, ts)
+        hi = bisect.bisect_right(self.times, ts)
+        return bisect.bisect_right(range(lo, hi), (height, tx_index),
+                                   key=lambda i: (self.heights[i], self.txs[i])) + lo
+
+    def end(self, ts):
+        """Posición después de la última entrada con tiempo <= ts."""
+        return bisect.bisect_right(self.times, ts)
+
+
+class ChainIndex:
+    def __init__(self, directory, read_only=False):
+        self.path = os.path.join(directory, POSTINGS_FILENAME)
+        self.read_only = read_only
+        self.postings = {field: {} for field in INDEX_FIELDS}
+        self.block_times = TimeSeries()
+        self.tx_times = TimeSeries()
+        self.height = 0             # alturas [0, height) indexadas
+        self._lock = threading.Lock()
+        self._load_lock = threading.Lock()
+        self._build_lock = threading.Lock()
+        self._loaded = False
+        self._store = None
+
+    def open(self, store, background=True):
+        """
+        Asocia el índice al almacén y programa la carga de postings.log en un
+        hilo de fondo. Hasta que termine, add_block no hace nada: los bloques
+        que se sellen mientras tanto los completa catch_up.
+        """
+        self._store = store
+        if background:
+            threading.Thread(target=self.load, name="chain-index-load", daemon=True).start()
+        return self
+
+    def load(self):
+        """Carga los registros persistidos que siguen coincidiendo con el almacén (una vez)."""
+        with self._load_lock:
+            if self._loaded:
+                return
+            store = self._store
+            good_end = 0
+            if os.path.exists(self.path):
+                with open(self.path, "rb") as f:
+                    for offset, payload in scan_records(f):
+                        rec = json.loads(payload)
+                        h = rec["height"]
+                        if (h != self.height or h >= len(store) or store.block_hash(h) != rec["hash"]
+                                or "time" not in rec):
+                            break
+                        self._insert(h, rec["entries"], rec["time"], rec["tx_times"])
+                        good_end = f.tell()
+                if not self.read_only and good_end < os.path.getsize(self.path):
+                    with open(self.path, "r+b") as f:
+                        f.truncate(good_end)
+                    print(f"[ÍNDICES] postings.log recortado a {self.height} bloques; "
+                          f"el resto se reconstruye desde la cadena.")
+            with self._lock:
+                self._loaded = True
+
+    def _insert(self, height, entries, block_time, tx_times):
+        for field, value, tx_index in entries:
+            self.postings[field].setdefault(value, []).append((height, tx_index))
+        if block_time is not None:
+            self.block_times.add(block_time, height)
+        for tx_index, ts in enumerate(tx_times):
+            if ts is not None:
+                self.tx_times.add(ts, height, tx_index)
+        self.height = height + 1
+
+    def _append(self, records):
+        if self.read_only or not records:
+            return
+        with open(self.path, "ab") as f:
+            f.write(b"".join(records))
+
+    def _build(self, height, block):
+        """Entradas del bloque y su registro para postings.log (sin tocar el índice)."""
+        entries = index_entries(block)
+        block_time, tx_times = time_entries(block)
+        payload = {"height": height, "hash": block.block_hash, "entries": entries,
+                   "time": block_time, "tx_times": tx_times}
+        record = encode_record(json.dumps(payload, separators=(",", ":")).encode())
+        return height, entries, block_time, tx_times, record
+
+    def add_block(self, block):
+        """Indexa un bloque recién sellado (llamado por el escritor de la cadena)."""
+        built = self._build(block.index, block)
+        with self._lock:
+            if not self._loaded or block.index != self.height:
+                return      # sin cargar o con un hueco: lo llenará catch_up desde el almacén
+            self._insert(*built[:4])
+            self._append([built[4]])
+
+    def catch_up(self, view):
+        """
+        Indexa las alturas de la vista que aún no están en el índice. Los
+        bloques se leen y se indexan fuera del lock (una reconstrucción larga no
+        frena al escritor); el lock se toma solo para incorporar el resultado.
+        """
+        self.load()
+        if self.height >= len(view):
+            return
+        with self._build_lock:     # una sola reconstrucción a la vez
+            built = [self._build(h, view[h]) for h in range(self.height, len(view))]
+            with self._lock:
+                fresh = [b for b in built if b[0] >= self.height]
+                for height, entries, block_time, tx_times, _ in fresh:
+                    self._insert(height, entries, block_time, tx_times)
+                self._append([b[4] for b in fresh])
+
+    def lookup(self, field, value, view):
+        """(altura, nº de tx) con field == value dentro de la vista, en orden de altura."""
+        self.catch_up(view)
+        postings = self.postings[field].get(value, ())
+        limit = len(view)
+        # Las listas solo crecen al final: se corta en el largo de la vista
+        end = len(postings)
+        while end and postings[end - 1][0] >= limit:
+            end -= 1
+        return postings[:end]
+
+    def time_range(self, kind, start, end, after, limit, view):
+        """
+        Hasta limit entradas (tiempo, altura, nº de tx) de la serie "blocks" o
+        "transactions" con start <= tiempo <= end, posteriores al cursor
+        after (una entrada anterior o None) y dentro de la vista. Retorna
+        (entradas, hay_más).
+        """
+        self.catch_up(view)
+        series = self.block_times if kind == "blocks" else self.tx_times
+        limit_height = len(view)
+        out = []
+        # Las inserciones fuera de orden desplazan los arreglos: se leen bajo el lock
+        with self._lock:
+            i = bisect.bisect_left(series.times, start)
+            if after:
+                i = max(i, series.seek(*after))
+            stop = series.end(end)
+            while i < stop:
+                entry = (series.times[i], series.heights[i], series.txs[i])
+                i += 1
+                if entry[1] >= limit_height:
+                    continue
+                if len(out) == limit:
+                    return out, True
+                out.append(entry)
+        return out, False
@@ -0,0 +1,81 @@
+# chain_writer.py
+import queue
+import threading
+from typing import List
+from concurrent.futures import Future
+
+from blockchain import SealError
+
+# ======== ESCRITOR ÚNICO DE LA CADENA ========
+# Los handlers no agregan bloques directamente: encolan las propuestas ya
+# decididas y un único hilo escritor las sella (altura y padre) y las
+# persiste en orden. Lo que se acumula en la cola mientras el escritor está
+# ocupado se sella en el siguiente lote y comparte el fsync del group commit.
+# Cada bloque enviado tiene su propio Future, que se resuelve con su altura
+# cuando es durable o falla con el error de su propia escritura: un bloque
+# que no se pudo sellar no arrastra a los demás del lote.
+
+
+class ChainWriter:
+    def __init__(self, chain):
+        self.chain = chain
+        self._queue = queue.Queue()
+        self._thread = None
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="chain-writer", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        if self._thread is not None:
+            self._queue.put(None)
+            self._thread.join()
+            self._thread = None
+
+    def submit(self, blocks) -> List[Future]:
+        """Encola bloques decididos; un Future por bloque que resuelve a su altura cuando es durable."""
+        done = [Future() for _ in blocks]
+        self._queue.put((list(blocks), done))
+        return done
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            batch = [item]
+            # Todo lo que ya está en cola entra en el mismo lote
+            while True:
+                try:
+                    nxt = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if nxt is None:
+                    self._queue.put(None)
+                    break
+                batch.append(nxt)
+            self._commit(batch)
+
+    def _commit(self, batch):
+        blocks = [b for blocks, _ in batch for b in blocks]
+        futures = [f for _, done in batch for f in done]
+        try:
+            durables = self.chain.add_blocks(blocks)
+        except Exception as e:
+            # add_blocks atrapa los errores de cada bloque: esto ocurre antes de escribir
+            print(f"[ESCRITOR] No se pudo sellar el lote de {len(blocks)} bloques: {e}")
+            for done in futures:
+                done.set_exception(SealError(str(e)))
+            return
+        for durable, done in zip(durables, futures):
+            durable.add_done_callback(lambda f, done=done: _resolve(f, done))
+
+
+def _resolve(durable, done):
+    error = durable.exception()
+    if error is not None:
+        done.set_exception(error)
+    else:
+        done.set_result(durable.result())
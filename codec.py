@@ -0,0 +1,311 @@
+# codec.py
+import os
+import json
+
+from block_log import atomic_write
+from encoding import Reader, put_varint, put_bytes, put_str, put_hex, put_value, _is_hex
+from quorum import SIGNATURE_SIZE, pack_bitmap, unpack_bitmap
+from hashing import HASH_V5_NONCE
+
+# ======== CODIFICACIÓN BINARIA DE BLOQUES ========
+# Formato compacto y versionado para disco y para intercambio entre procesos.
+# Se convierte sin pérdida a la forma de Block.to_dict(), que sigue siendo el
+# formato de la API HTTP.
+#
+#   u8      versión del codec
+#   varint  index
+#   varint  hash_version         (desde la versión 2 del codec; en la 1 es 1)
+#   hex     previous_hash        (32 bytes crudos)
+#   str     timestamp
+#   id      leader
+#   str     stage_name
+#   str     responsible_id
+#   hex     nonce                (solo si hash_version >= 5)
+#   varint  nº de transacciones, y por cada una:
+#             str sender, str actor_type, valor payload, str timestamp,
+#             str responsible_id, hex responsible_signature
+#   firmas                       (ver abajo)
+#   certificado                  (ver abajo)
+#   hex     block_hash           (32 bytes crudos)
+#
+# Firmas. Versiones 1 y 2: varint nº de firmas y por cada una id validador y
+# hex firma. Desde la versión 3 empiezan con un varint de modo:
+#   0  lista de pares (id, hex firma), igual que antes
+#   1  bytes bitmap sobre los índices de la tabla de IDs (little endian) y
+#      las firmas de 64 bytes concatenadas en el orden de los bits
+# El modo 1 ahorra el id y el prefijo de cada firma; con cientos de
+# validadores el bitmap ocupa k/8 bytes.
+#
+# Certificado. Versiones 1 y 2: valor genérico. Desde la versión 3, un u8:
+#   0  valor genérico a continuación
+#   1..3  estado ACCEPTED / REJECTED / GENESIS compacto: varint q_required,
+#      u8 banderas (1 = consensus_timestamp, 2 = reason, 4 = consensus,
+#      8 = seal: firma de 64 bytes del líder) y los campos presentes.
+#      q_collected no se guarda: es el nº de firmas.
+#
+# "id" es un identificador de nodo internado: varint (i << 1) | 1 apunta a la
+# entrada i de la tabla de IDs; varint (len << 1) seguido de UTF-8 es el
+# nombre en línea (cuando no hay tabla, p. ej. entre procesos).
+#
+# Los registros antiguos en JSON empiezan con "{" (0x7B), nunca con una
+# versión válida, por lo que ambos formatos conviven en el mismo almacén.
+
+CODEC_VERSION = 3
+SUPPORTED_VERSIONS = (1, 2, 3)
+JSON_RECORD_PREFIX = ord("{")
+
+SIGS_PAIRS, SIGS_BITMAP = 0, 1
+CERT_GENERIC = 0
+CERT_STATUS_CODES = {"ACCEPTED": 1, "REJECTED": 2, "GENESIS": 3}
+CERT_STATUSES = {code: status for status, code in CERT_STATUS_CODES.items()}
+CERT_TIMESTAMP, CERT_REASON, CERT_CONSENSUS, CERT_SEAL = 1, 2, 4, 8
+
+
+class IdTable:
+    """Tabla persistente de IDs de nodos (validadores) internados."""
+
+    def __init__(self, path=None):
+        self.path = path
+        self.names = []
+        self._ids = {}
+
+    def load(self):
+        if self.path and os.path.exists(self.path):
+            with open(self.path, "r") as f:
+                self.names = json.load(f)
+            self._ids = {name: i for i, name in enumerate(self.names)}
+        return self
+
+    def intern(self, name: str) -> int:
+        i = self._ids.get(name)
+        if i is None:
+            i = len(self.names)
+            self.names.append(name)
+            self._ids[name] = i
+            # Se persiste antes de escribir cualquier registro que lo use
+            if self.path:
+                atomic_write(self.path, json.dumps(self.names).encode())
+        return i
+
+
+def _put_id(buf, name, ids):
+    if ids is not None:
+        put_varint(buf, (ids.intern(name) << 1) | 1)
+    else:
+        data = name.encode()
+        put_varint(buf, len(data) << 1)
+        buf += data
+
+
+def _read_id(r, ids):
+    head = r.varint()
+    if head & 1:
+        return ids.names[head >> 1]
+    start = r.pos
+    r.pos = start + (head >> 1)
+    return str(r.data[start:r.pos], "utf-8")
+
+
+def encode_transaction(buf: bytearray, tx: dict):
+    put_str(buf, tx.get("sender", ""))
+    put_str(buf, tx.get("actor_type", ""))
+    put_value(buf, tx.get("payload", {}))
+    put_str(buf, tx.get("timestamp", ""))
+    put_str(buf, tx.get("responsible_id", ""))
+    put_hex(buf, tx.get("responsible_signature", ""))
+
+
+def decode_transaction(r: Reader) -> dict:
+    return {
+        "sender": r.str(),
+        "actor_type": r.str(),
+        "payload": r.value(),
+        "timestamp": r.str(),
+        "responsible_id": r.str(),
+        "responsible_signature": r.hex(),
+    }
+
+
+def _bitmap_signatures(signatures, ids):
+    """[(índice en la tabla, firma cruda)] ordenado, o None si no aplica el modo bitmap."""
+    if ids is None or not signatures:
+        return None
+    entries = []
+    for vid, sig in signatures.items():
+        if len(sig) != 2 * SIGNATURE_SIZE or not _is_hex(sig):
+            return None
+        entries.append((ids.intern(vid), bytes.fromhex(sig)))
+    entries.sort()
+    return entries
+
+
+def encode_signatures(buf: bytearray, signatures: dict, ids: IdTable = None):
+    entries = _bitmap_signatures(signatures, ids)
+    if entries is None:
+        put_varint(buf, SIGS_PAIRS)
+        put_varint(buf, len(signatures))
+        for vid, sig in signatures.items():
+            _put_id(buf, vid, ids)
+            put_hex(buf, sig)
+        return
+    put_varint(buf, SIGS_BITMAP)
+    bitmap = 0
+    for i, _ in entries:
+        bitmap |= 1 << i
+    put_bytes(buf, pack_bitmap(bitmap))
+    for _, sig in entries:
+        buf += sig
+
+
+def decode_signatures(r: Reader, ids: IdTable = None) -> dict:
+    """Firmas {validator_id: hex}; en modo bitmap, en el orden de la tabla de IDs."""
+    mode = r.varint()
+    if mode == SIGS_PAIRS:
+        return {_read_id(r, ids): r.hex() for _ in range(r.varint())}
+    if mode != SIGS_BITMAP:
+        raise ValueError(f"Modo de firmas desconocido: {mode}")
+    bitmap = unpack_bitmap(r.bytes())
+    out = {}
+    pos = 0
+    while bitmap:
+        if bitmap & 1:
+            out[ids.names[pos]] = r.raw(SIGNATURE_SIZE).hex()
+        bitmap >>= 1
+        pos += 1
+    return out
+
+
+def _compact_certificate_fields(cert: dict, n_signatures: int):
+    """Campos del certificado en orden canónico, o None si no tiene esa forma exacta."""
+    code = CERT_STATUS_CODES.get(cert.get("status"))
+    if code is None:
+        return None
+    expected = ["status"]
+    flags = 0
+    if "q_required" in cert:
+        expected += ["q_required", "q_collected"]
+        q_required, q_collected = cert["q_required"], cert.get("q_collected")
+        if (type(q_required) is not int or q_required < 0
+                or type(q_collected) is not int or q_collected != n_signatures):
+            return None
+    else:
+        q_required = None
+    for key, flag in (("consensus_timestamp", CERT_TIMESTAMP), ("reason", CERT_REASON)):
+        if key in cert:
+            if not isinstance(cert[key], str):
+                return None
+            expected.append(key)
+            flags |= flag
+    if "consensus" in cert:
+        if cert["consensus"] is not True:
+            return None
+        expected.append("consensus")
+        flags |= CERT_CONSENSUS
+    if "seal" in cert:
+        seal = cert["seal"]
+        if not isinstance(seal, str) or len(seal) != 2 * SIGNATURE_SIZE or not _is_hex(seal):
+            return None
+        expected.append("seal")
+        flags |= CERT_SEAL
+    # El orden de las claves debe sobrevivir la ida y vuelta
+    if list(cert) != expected:
+        return None
+    return code, q_required, flags
+
+
+def encode_certificate(buf: bytearray, cert: dict, n_signatures: int):
+    fields = _compact_certificate_fields(cert, n_signatures) if isinstance(cert, dict) else None
+    if fields is None:
+        buf.append(CERT_GENERIC)
+        put_value(buf, cert)
+        return
+    code, q_required, flags = fields
+    buf.append(code)
+    # q_required + 1; 0 indica que el certificado no declara quórum (génesis)
+    put_varint(buf, 0 if q_required is None else q_required + 1)
+    buf.append(flags)
+    if flags & CERT_TIMESTAMP:
+        put_str(buf, cert["consensus_timestamp"])
+    if flags & CERT_REASON:
+        put_str(buf, cert["reason"])
+    if flags & CERT_SEAL:
+        buf += bytes.fromhex(cert["seal"])
+
+
+def decode_certificate(r: Reader, n_signatures: int) -> dict:
+    code = r.u8()
+    if code == CERT_GENERIC:
+        return r.value()
+    cert = {"status": CERT_STATUSES[code]}
+    q_required = r.varint()
+    if q_required:
+        cert["q_required"] = q_required - 1
+        cert["q_collected"] = n_signatures
+    flags = r.u8()
+    if flags & CERT_TIMESTAMP:
+        cert["consensus_timestamp"] = r.str()
+    if flags & CERT_REASON:
+        cert["reason"] = r.str()
+    if flags & CERT_CONSENSUS:
+        cert["consensus"] = True
+    if flags & CERT_SEAL:
+        cert["seal"] = r.raw(SIGNATURE_SIZE).hex()
+    return cert
+
+
+def encode_block(block, ids: IdTable = None) -> bytes:
+    """Serializa un Block al formato binario compacto."""
+    buf = bytearray()
+    buf.append(CODEC_VERSION)
+    put_varint(buf, block.index)
+    put_varint(buf, block.hash_version)
+    put_hex(buf, block.previous_hash)
+    put_str(buf, block.timestamp)
+    _put_id(buf, block.leader, ids)
+    put_str(buf, block.stage_name)
+    put_str(buf, block.responsible_id)
+    if block.hash_version >= HASH_V5_NONCE:
+        put_hex(buf, block.nonce)
+    put_varint(buf, len(block.transactions))
+    for tx in block.transactions:
+        encode_transaction(buf, tx)
+    encode_signatures(buf, block.signatures, ids)
+    encode_certificate(buf, block.certificate, len(block.signatures))
+    put_hex(buf, block.block_hash)
+    return bytes(buf)
+
+
+def decode_block(data, ids: IdTable = None) -> dict:
+    """Decodifica un registro binario a la forma de Block.to_dict()."""
+    r = Reader(data)
+    version = r.u8()
+    if version not in SUPPORTED_VERSIONS:
+        raise ValueError(f"Versión de codec no soportada: {version}")
+    index = r.varint()
+    out = {
+        "index": index,
+        "hash_version": r.varint() if version >= 2 else 1,
+        "previous_hash": r.hex(),
+        "timestamp": r.str(),
+        "leader": _read_id(r, ids),
+        "stage_name": r.str(),
+        "responsible_id": r.str(),
+    }
+    if out["hash_version"] >= HASH_V5_NONCE:
+        out["nonce"] = r.hex()
+    out["transactions"] = [decode_transaction(r) for _ in range(r.varint())]
+    if version >= 3:
+        out["signatures"] = decode_signatures(r, ids)
+        out["certificate"] = decode_certificate(r, len(out["signatures"]))
+    else:
+        out["signatures"] = {_read_id(r, ids): r.hex() for _ in range(r.varint())}
+        out["certificate"] = r.value()
+    out["hash"] = r.hex()
+    return out
+
+
+def decode_record(data, ids: IdTable = None) -> dict:
+    """Decodifica un registro del almacén, sea binario o JSON heredado."""
+    if data[0] == JSON_RECORD_PREFIX:
+        return json.loads(bytes(data))
+    return decode_block(data, ids)
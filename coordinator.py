@@ -0,0 +1,187 @@
+# coordinator.py
+import os
+import sys
+import asyncio
+import argparse
+import threading
+from multiprocessing.managers import BaseManager
+
+from fastapi import HTTPException
+
+import codec
+from blockchain import Block
+from block_store import BlockStore
+from chain_index import ChainIndex
+
+# ======== COORDINADOR DE ESTADO COMPARTIDO ========
+# Proceso único dueño del estado de consenso (cadena, pendientes, mempool,
+# plazos). Los workers de uvicorn se conectan por un socket Unix y llaman a
+# sus operaciones con RPC (multiprocessing.managers); las respuestas son
+# tuplas ("ok", valor) o ("error", (status, detalle)) para que las
+# HTTPException crucen el socket sin depender de cómo se serializan.
+#
+# La clave de autenticación se genera al arrancar y queda junto al socket
+# (<socket>.key, modo 0600): solo procesos del mismo usuario pueden conectarse.
+#
+# Lecturas de la cadena: cada worker abre el almacén en solo lectura y, antes
+# de leer, adopta el largo publicado por el coordinador (BlockStore.refresh).
+# Los índices secundarios se cargan de postings.log al conectarse y cada
+# worker los completa en memoria desde su vista del almacén.
+
+REMOTE_METHODS = frozenset({
+    "info", "submit_transaction", "sign_pending_block", "sign_pending_blocks",
+    "mark_pending_block_failed", "resolve_pending_ids", "list_pending_blocks",
+    "chain_length", "metrics",
+})
+
+
+class CoordinatorManager(BaseManager):
+    pass
+
+
+def _key_path(address):
+    return address + ".key"
+
+
+class CoordinatorEndpoint:
+    """Lado servidor: ejecuta cada llamada sobre el LocalConsensus del coordinador."""
+
+    def __init__(self, local, loop):
+        self.local = local
+        self.loop = loop
+
+    def call(self, method, args):
+        if method not in REMOTE_METHODS:
+            return ("error", (400, f"Operación desconocida: {method}"))
+        fn = getattr(self.local, method)
+        try:
+            if asyncio.iscoroutinefunction(fn):
+                value = asyncio.run_coroutine_threadsafe(fn(*args), self.loop).result()
+            else:
+                value = fn(*args)
+        except HTTPException as e:
+            return ("error", (e.status_code, e.detail))
+        return ("ok", value)
+
+
+class RemoteConsensus:
+    """Lado worker: misma interfaz que service.LocalConsensus, vía el coordinador."""
+
+    def __init__(self, address):
+        with open(_key_path(address), "rb") as f:
+            authkey = f.read()
+        CoordinatorManager.register("consensus")
+        manager = CoordinatorManager(address=address, authkey=authkey)
+        manager.connect()
+        # El proxy abre una conexión por hilo, así que se puede usar desde el
+        # pool de hilos de asyncio y desde los handlers síncronos a la vez.
+        self._remote = manager.consensus()
+        self.directory = self._call_sync("info")["directory"]
+        self.ids = codec.IdTable(os.path.join(self.directory, "ids.json")).load()
+        self.store = BlockStore(self.directory, decode=self._decode).open_read_only()
+        # Índices en memoria: se cargan de postings.log y se completan desde el almacén
+        self.index = ChainIndex(self.directory, read_only=True).open(self.store)
+
+    def _decode(self, payload):
+        try:
+            return Block.from_dict(codec.decode_record(payload, self.ids))
+        except IndexError:
+            # El coordinador internó un ID nuevo después de que lo cargamos
+            self.ids.load()
+            return Block.from_dict(codec.decode_record(payload, self.ids))
+
+    def _call_sync(self, method, *args):
+        status, value = self._remote.call(method, args)
+        if status == "error":
+            raise HTTPException(status_code=value[0], detail=value[1])
+        return value
+
+    async def _call(self, method, *args):
+        # El RPC es bloqueante: se hace fuera del event loop del worker
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, lambda: self._call_sync(method, *args))
+
+    async def submit_transaction(self, tx):
+        return await self._call("submit_transaction", tx)
+
+    async def sign_pending_block(self, pending_id, validator_id):
+        return await self._call("sign_pending_block", pending_id, validator_id)
+
+    async def sign_pending_blocks(self, pending_ids, validator_id):
+        return await self._call("sign_pending_blocks", list(pending_ids), validator_id)
+
+    async def mark_pending_block_failed(self, pending_id):
+        return await self._call("mark_pending_block_failed", pending_id)
+
+    async def resolve_pending_ids(self, ids=(), desde=None, hasta=None, validator_id=None, todas=False):
+        return await self._call("resolve_pending_ids", list(ids), desde, hasta, validator_id, todas)
+
+    async def list_pending_blocks(self, validator_id=None):
+        return await self._call("list_pending_blocks", validator_id)
+
+    def chain_length(self):
+        return self._call_sync("chain_length")
+
+    def chain_view(self):
+        self.store.refresh(self.chain_length())
+        return self.store.snapshot()
+
+    def chain_index(self):
+        return self.index
+
+    async def metrics(self):
+        from offload import loop_lag
+        from json_cache import block_json
+        data = await self._call("metrics")
+        data["worker_pid"] = os.getpid()
+        data["worker_event_loop_lag"] = loop_lag.stats()
+        data["worker_block_json_cache"] = block_json.stats()
+        return data
+
+    def background_tasks(self):
+        return []   # corren en el coordinador
+
+
+# ======== PROCESO COORDINADOR ========
+
+def _run_loop(loop, local):
+    from offload import loop_lag
+    asyncio.set_event_loop(loop)
+    for coro in local.background_tasks() + [loop_lag.run()]:
+        loop.create_task(coro)
+    loop.run_forever()
+
+
+def serve(address):
+    from service import LocalConsensus
+    local = LocalConsensus()
+
+    loop = asyncio.new_event_loop()
+    threading.Thread(target=_run_loop, args=(loop, local), name="coordinator-loop", daemon=True).start()
+
+    endpoint = CoordinatorEndpoint(local, loop)
+    CoordinatorManager.register("consensus", callable=lambda: endpoint)
+
+    if os.path.exists(address):
+        os.unlink(address)
+    authkey = os.urandom(32)
+    fd = os.open(_key_path(address), os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, "wb") as f:
+        f.write(authkey)
+
+    manager = CoordinatorManager(address=address, authkey=authkey)
+    server = manager.get_server()
+    print(f"[COORDINADOR] Escuchando en {address} (pid {os.getpid()})")
+    server.serve_forever()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Coordinador de estado compartido para varios workers.")
+    parser.add_argument("--socket", default="blockchain.sock", help="ruta del socket Unix")
+    args = parser.parse_args(argv)
+    serve(os.path.abspath(args.socket))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,85 @@
+# deadlines.py
+import time
+import heapq
+import asyncio
+import threading
+from typing import List
+
+# ======== PLAZOS DE LAS PROPUESTAS ========
+# Cada propuesta recibe un plazo (TTL) al crearse. Los plazos viven en un heap
+# ordenado por vencimiento: la tarea de fondo duerme hasta el más próximo,
+# saca todos los vencidos de una vez y los rechaza en un solo lote. No hay
+# sondeo por propuesta: las que se sellan antes de vencer simplemente se
+# descartan al salir del heap (eliminación perezosa).
+
+DEFAULT_TTL_SECONDS = 300.0
+
+
+class DeadlineScheduler:
+    def __init__(self, ttl_seconds=DEFAULT_TTL_SECONDS):
+        self.ttl_seconds = ttl_seconds
+        self._heap = []                 # (vencimiento monotónico, pending_id)
+        self._lock = threading.Lock()
+        self._wakeup = asyncio.Event()
+        self._loop = None               # loop de la tarea de fondo (para despertarla desde otros hilos)
+
+    def __len__(self):
+        return len(self._heap)
+
+    def schedule(self, pending_id, ttl_seconds=None):
+        ttl = self.ttl_seconds if ttl_seconds is None else ttl_seconds
+        deadline = time.monotonic() + ttl
+        with self._lock:
+            earliest = self._heap[0][0] if self._heap else None
+            heapq.heappush(self._heap, (deadline, pending_id))
+            if earliest is None or deadline < earliest:
+                self._notify()          # el nuevo plazo es el más próximo
+
+    def _notify(self):
+        # schedule() puede llamarse desde el pool criptográfico
+        if self._loop is not None and not self._loop.is_closed():
+            self._loop.call_soon_threadsafe(self._wakeup.set)
+        else:
+            self._wakeup.set()
+
+    def next_deadline(self):
+        """Vencimiento más próximo (time.monotonic), o None si no hay plazos."""
+        with self._lock:
+            return self._heap[0][0] if self._heap else None
+
+    def pop_expired(self) -> List[int]:
+        """Saca del heap todos los ids cuyo plazo ya venció."""
+        now = time.monotonic()
+        expired = []
+        with self._lock:
+            while self._heap and self._heap[0][0] <= now:
+                expired.append(heapq.heappop(self._heap)[1])
+        return expired
+
+    async def wait_for_work(self, timeout=None):
+        self._loop = asyncio.get_running_loop()
+        try:
+            await asyncio.wait_for(self._wakeup.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        self._wakeup.clear()
+
+
+async def run_expiry_loop(scheduler: DeadlineScheduler, expire):
+    """Tarea de fondo: espera al plazo más próximo y llama a expire(ids) con los vencidos."""
+    while True:
+        deadline = scheduler.next_deadline()
+        if deadline is None:
+            await scheduler.wait_for_work()
+            continue
+        delay = deadline - time.monotonic()
+        if delay > 0:
+            # Se despierta antes si llega un plazo más próximo
+            await scheduler.wait_for_work(delay)
+            continue
+        expired = scheduler.pop_expired()
+        if expired:
+            try:
+                await expire(expired)
+            except Exception as e:
+                print(f"[PLAZOS] Error al rechazar propuestas vencidas: {e}")
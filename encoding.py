@@ -0,0 +1,168 @@
+# encoding.py
+import struct
+
+# ======== PRIMITIVAS BINARIAS ========
+# Bloques de construcción del formato compacto (codec.py) y de la codificación
+# canónica de cabeceras: varints LEB128, cadenas con longitud, hashes y firmas
+# hex guardados como bytes crudos, y valores JSON con etiqueta de tipo.
+
+_DOUBLE = struct.Struct("<d")
+
+# Etiquetas de valores tipo JSON
+T_NONE, T_FALSE, T_TRUE, T_INT, T_FLOAT, T_STR, T_LIST, T_DICT = range(8)
+
+
+def put_varint(buf: bytearray, n: int):
+    """Entero no negativo en LEB128 (7 bits por byte)."""
+    while n > 0x7F:
+        buf.append((n & 0x7F) | 0x80)
+        n >>= 7
+    buf.append(n)
+
+
+def put_bytes(buf: bytearray, data: bytes):
+    put_varint(buf, len(data))
+    buf += data
+
+
+def put_str(buf: bytearray, s: str):
+    put_bytes(buf, s.encode())
+
+
+def _is_hex(s: str) -> bool:
+    if len(s) % 2:
+        return False
+    try:
+        return bytes.fromhex(s).hex() == s
+    except ValueError:
+        return False
+
+
+def put_hex(buf: bytearray, s: str):
+    """
+    Hashes y firmas: si la cadena es hex en minúsculas se guardan los bytes
+    crudos (32 B por hash, 64 B por firma); si no, la cadena tal cual. El bit
+    bajo del prefijo distingue ambos casos, así la conversión no pierde nada.
+    """
+    if s and _is_hex(s):
+        raw = bytes.fromhex(s)
+        put_varint(buf, (len(raw) << 1) | 1)
+        buf += raw
+    else:
+        data = s.encode()
+        put_varint(buf, len(data) << 1)
+        buf += data
+
+
+def put_value(buf: bytearray, v, sort_keys=False):
+    """Valor JSON con etiqueta de tipo. sort_keys=True da una forma canónica."""
+    if v is None:
+        buf.append(T_NONE)
+    elif v is True:
+        buf.append(T_TRUE)
+    elif v is False:
+        buf.append(T_FALSE)
+    elif isinstance(v, int):
+        buf.append(T_INT)
+        put_varint(buf, (v << 1) if v >= 0 else ((-v << 1) - 1))   # zigzag
+    elif isinstance(v, float):
+        buf.append(T_FLOAT)
+        buf += _DOUBLE.pack(v)
+    elif isinstance(v, str):
+        buf.append(T_STR)
+        put_str(buf, v)
+    elif isinstance(v, (list, tuple)):
+        buf.append(T_LIST)
+        put_varint(buf, len(v))
+        for item in v:
+            put_value(buf, item, sort_keys)
+    elif isinstance(v, dict):
+        buf.append(T_DICT)
+        put_varint(buf, len(v))
+        items = sorted(v.items()) if sort_keys else v.items()
+        for k, item in items:
+            put_str(buf, str(k))
+            put_value(buf, item, sort_keys)
+    else:
+        # Igual que json.dumps(default=str) en /download_chain
+        buf.append(T_STR)
+        put_str(buf, str(v))
+
+
+class Reader:
+    """Cursor de lectura sobre un buffer codificado con las primitivas de arriba."""
+
+    __slots__ = ("data", "pos")
+
+    def __init__(self, data, pos=0):
+        self.data = data
+        self.pos = pos
+
+    def u8(self) -> int:
+        b = self.data[self.pos]
+        self.pos += 1
+        return b
+
+    def varint(self) -> int:
+        data = self.data
+        pos = self.pos
+        b = data[pos]
+        pos += 1
+        if b < 0x80:
+            self.pos = pos
+            return b
+        n = b & 0x7F
+        shift = 7
+        while True:
+            b = data[pos]
+            pos += 1
+            n |= (b & 0x7F) << shift
+            if b < 0x80:
+                self.pos = pos
+                return n
+            shift += 7
+
+    def raw(self, n: int) -> bytes:
+        start = self.pos
+        self.pos = start + n
+        return bytes(self.data[start:self.pos])
+
+    def bytes(self) -> bytes:
+        return self.raw(self.varint())
+
+    def str(self) -> str:
+        n = self.varint()
+        start = self.pos
+        self.pos = start + n
+        return str(self.data[start:self.pos], "utf-8")
+
+    def hex(self) -> str:
+        head = self.varint()
+        n = head >> 1
+        start = self.pos
+        self.pos = start + n
+        chunk = self.data[start:self.pos]
+        return chunk.hex() if head & 1 else str(chunk, "utf-8")
+
+    def value(self):
+        tag = self.u8()
+        if tag == T_STR:
+            return self.str()
+        if tag == T_DICT:
+            return {self.str(): self.value() for _ in range(self.varint())}
+        if tag == T_INT:
+            z = self.varint()
+            return (z >> 1) if not z & 1 else -((z + 1) >> 1)
+        if tag == T_LIST:
+            return [self.value() for _ in range(self.varint())]
+        if tag == T_NONE:
+            return None
+        if tag == T_TRUE:
+            return True
+        if tag == T_FALSE:
+            return False
+        if tag == T_FLOAT:
+            v = _DOUBLE.unpack_from(self.data, self.pos)[0]
+            self.pos += _DOUBLE.size
+            return v
+        raise ValueError(f"Etiqueta de valor desconocida: {tag}")
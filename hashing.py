@@ -0,0 +1,332 @@
+# hashing.py
+import json
+import struct
+import hashlib
+
+import merkle
+from encoding import put_varint, put_str, put_hex, put_value
+
+# ======== CODIFICACIÓN CANÓNICA DE CABECERAS ========
+# Versión 1 (heredada): sha256(json.dumps(header_dict(), sort_keys=True)).
+#
+# Versión 2: la cabecera tiene una disposición fija y se alimenta por partes
+# a hashlib.sha256, sin construir diccionarios ni cadenas intermedias:
+#
+#   b"SCBH"            etiqueta de dominio (Supply Chain Block Header)
+#   u8                 versión de cabecera (2 o 3)
+#   u64 LE             index
+#   32 bytes           previous_hash (crudo)
+#   32 bytes           raíz de transacciones
+#   varint + UTF-8     timestamp, leader, stage_name, responsible_id
+#
+# Hoja de una transacción: sha256(b"\x00" || transacción canónica), donde la
+# transacción canónica es: sender, actor_type, timestamp, responsible_id (str),
+# firma del responsable (hex) y payload como valor con claves ordenadas.
+#
+# Raíz de transacciones:
+#   versión 2: sha256(b"SCTR" || varint n || hoja_0 || ... || hoja_n-1)
+#   versión 3: raíz de Merkle de las hojas (merkle.py), lo que permite probar
+#              la inclusión de una transacción con O(log n) hashes.
+#
+# Versión 4 (consenso en tubería): el contenido del bloque se separa de su
+# posición en la cadena. Los validadores firman el digest de contenido
+#
+#   sha256(b"SCBC" || u8 versión || raíz de Merkle || timestamp, leader,
+#          stage_name, responsible_id)
+#
+# y la altura y el padre se asignan al sellar el bloque:
+#
+#   sha256(b"SCBH" || u8 versión || u64 LE index || previous_hash || digest)
+#
+# Así varias propuestas pueden estar en consenso a la vez y las firmas siguen
+# siendo válidas sin importar en qué orden lleguen al quórum.
+#
+# Como esas firmas no cubren la altura ni el padre, al sellar un bloque v4 su
+# líder firma además el mensaje de sello
+#
+#   sha256(b"SCBS" || block_hash)
+#
+# (certificate["seal"]). Sin la clave del líder no se puede mover, borrar ni
+# reordenar un bloque y recalcular los enlaces sin que falle la verificación.
+#
+# Versión 5: igual que la 4, pero el digest de contenido termina con el nonce
+# aleatorio de la propuesta (varint + UTF-8 de su hex). Dos propuestas con el
+# mismo lote, líder y segundo ya no comparten digest, así que un contenido
+# repetido en la cadena solo puede ser un bloque reproducido.
+
+HASH_V1_JSON = 1
+HASH_V2_CANONICAL = 2
+HASH_V3_MERKLE = 3
+HASH_V4_PIPELINED = 4
+HASH_V5_NONCE = 5
+CURRENT_HASH_VERSION = HASH_V5_NONCE
+
+HEADER_TAG = b"SCBH"
+CONTENT_TAG = b"SCBC"
+SEAL_TAG = b"SCBS"
+TX_ROOT_TAG = b"SCTR"
+TX_LEAF_PREFIX = b"\x00"
+
+_U64 = struct.Struct("<Q")
+
+
+def _hash32(hex_str: str) -> bytes:
+    raw = bytes.fromhex(hex_str)
+    if len(raw) != 32:
+        raise ValueError(f"Se esperaba un hash de 32 bytes: {hex_str!r}")
+    return raw
+
+
+def encode_transaction(tx: dict) -> bytes:
+    """Codificación canónica de una transacción (independiente del orden de claves)."""
+    buf = bytearray()
+    put_str(buf, tx.get("sender", ""))
+    put_str(buf, tx.get("actor_type", ""))
+    put_str(buf, tx.get("timestamp", ""))
+    put_str(buf, tx.get("responsible_id", ""))
+    put_hex(buf, tx.get("responsible_signature", ""))
+    put_value(buf, tx.get("payload", {}), sort_keys=True)
+    return bytes(buf)
+
+
+def transaction_leaf(tx: dict) -> bytes:
+    return hashlib.sha256(TX_LEAF_PREFIX + encode_transaction(tx)).digest()
+
+
+def transactions_root(transactions, hash_version=CURRENT_HASH_VERSION) -> bytes:
+    if hash_version >= HASH_V3_MERKLE:
+        return merkle.merkle_root([transaction_leaf(tx) for tx in transactions])
+    h = hashlib.sha256(TX_ROOT_TAG)
+    count = bytearray()
+    put_varint(count, len(transactions))
+    h.update(count)
+    for tx in transactions:
+        h.update(transaction_leaf(tx))
+    return h.digest()
+
+
+def _put_header_strings(h, timestamp, leader, stage_name, responsible_id):
+    tail = bytearray()
+    put_str(tail, timestamp)
+    put_str(tail, leader)
+    put_str(tail, stage_name)
+    put_str(tail, responsible_id)
+    h.update(tail)
+
+
+def content_digest_from_fields(hash_version, tx_root: bytes, timestamp, leader,
+                               stage_name, responsible_id, nonce="") -> bytes:
+    """Digest del contenido de un bloque versión 4 o 5 (lo que firman los validadores)."""
+    h = hashlib.sha256(CONTENT_TAG)
+    h.update(bytes((hash_version,)))
+    h.update(tx_root)
+    _put_header_strings(h, timestamp, leader, stage_name, responsible_id)
+    if hash_version >= HASH_V5_NONCE:
+        tail = bytearray()
+        put_str(tail, nonce)
+        h.update(tail)
+    return h.digest()
+
+
+def header_hash_from_fields(hash_version, index, previous_hash, tx_root: bytes,
+                            timestamp, leader, stage_name, responsible_id, nonce="") -> str:
+    """
+    Hash de una cabecera canónica (versión 2 a 5) a partir de sus campos y de
+    la raíz de transacciones. Es lo que necesita un auditor para comprobar una
+    prueba de inclusión sin descargar el bloque.
+    """
+    h = hashlib.sha256(HEADER_TAG)
+    h.update(bytes((hash_version,)))
+    h.update(_U64.pack(index))
+    h.update(_hash32(previous_hash))
+    if hash_version >= HASH_V4_PIPELINED:
+        h.update(content_digest_from_fields(hash_version, tx_root, timestamp, leader,
+                                            stage_name, responsible_id, nonce))
+    else:
+        h.update(tx_root)
+        _put_header_strings(h, timestamp, leader, stage_name, responsible_id)
+    return h.hexdigest()
+
+
+def content_digest(block) -> str:
+    """Digest de contenido en hex; no depende de la altura ni del padre."""
+    return content_digest_from_fields(
+        block.hash_version, transactions_root(block.transactions, block.hash_version),
+        block.timestamp, block.leader, block.stage_name, block.responsible_id, block.nonce,
+    ).hex()
+
+
+def signing_message(block) -> str:
+    """
+    Mensaje que firman los validadores: el digest de contenido desde la
+    versión 4 y el hash del bloque en las anteriores.
+    """
+    if block.hash_version >= HASH_V4_PIPELINED:
+        return content_digest(block)
+    return block.block_hash
+
+
+def seal_message(block) -> str:
+    """Mensaje que firma el líder al sellar un bloque v4/v5 (ata contenido, altura y padre)."""
+    return hashlib.sha256(SEAL_TAG + _hash32(block.block_hash)).hexdigest()
+
+
+def _header_hash_canonical(block) -> str:
+    return header_hash_from_fields(
+        block.hash_version, block.index, block.previous_hash,
+        transactions_root(block.transactions, block.hash_version),
+        block.timestamp, block.leader, block.stage_name, block.responsible_id, block.nonce,
+    )
+
+
+def _header_hash_v1(block) -> str:
+    block_string = json.dumps(block.header_dict(), sort_keys=True).encode()
+    return hashlib.sha256(block_string).hexdigest()
+
+
+_HASHERS = {
+    HASH_V1_JSON: _header_hash_v1,
+    HASH_V2_CANONICAL: _header_hash_canonical,
+    HASH_V3_MERKLE: _header_hash_canonical,
+    HASH_V4_PIPELINED: _header_hash_canonical,
+    HASH_V5_NONCE: _header_hash_canonical,
+}
+
+
+def header_hash(block) -> str:
+    """Hash de la cabecera según la versión con la que se selló el bloque."""
+    hasher = _HASHERS.get(block.hash_version)
+    if hasher is None:
+        raise ValueError(f"Versión de hash desconocida: {block.hash_version}")
+    return hasher(block)
+
+
+def verify_header_hash(block) -> bool:
+    """Modo de compatibilidad: verifica el bloque con la versión con que fue hasheado."""
+    try:
+        return header_hash(block) == block.block_hash
+    except ValueError:
+        return False
+
+
+# ======== VECTORES DE PRUEBA ========
+# Vectores de referencia de la especificación: cualquier implementación de la
+# cabecera (otro lenguaje, un auditor externo) debe reproducir estos hashes.
+
+_VECTOR_TX = {
+    "sender": "alice",
+    "actor_type": "usuario",
+    "payload": {"stage": "Cosecha", "batch": "L-001", "descripcion": "Café pergamino", "responsable": "Juan"},
+    "timestamp": "2025-11-29 05:04:01",
+    "responsible_id": "",
+    "responsible_signature": "",
+}
+
+HEADER_TEST_VECTORS = [
+    {
+        "name": "genesis-v5",
+        "block": {
+            "index": 0, "previous_hash": "0" * 64, "timestamp": "2025-11-29 05:00:00",
+            "leader": "SISTEMA", "stage_name": "Genesis", "transactions": [],
+            "responsible_id": "SISTEMA", "hash_version": HASH_V5_NONCE,
+        },
+        "hash": "8380266800f58dd0e6e6636c4b9dd71883bf67de38094b1bcce6f5360ceabf3e",
+    },
+    {
+        "name": "three-tx-v5",
+        "block": {
+            "index": 7, "previous_hash": "cd" * 32, "timestamp": "2025-11-29 05:10:00",
+            "leader": "validator_1", "stage_name": "Transporte",
+            "transactions": [_VECTOR_TX, dict(_VECTOR_TX, sender="maria"), dict(_VECTOR_TX, timestamp="2025-11-29 05:09:59")],
+            "responsible_id": "", "nonce": "00112233445566778899aabbccddeeff", "hash_version": HASH_V5_NONCE,
+        },
+        "hash": "19ced294004ef3057b582c10493a7006bca4134554429e73a9443cbb060c6c5b",
+    },
+    {
+        "name": "genesis-v4",
+        "block": {
+            "index": 0, "previous_hash": "0" * 64, "timestamp": "2025-11-29 05:00:00",
+            "leader": "SISTEMA", "stage_name": "Genesis", "transactions": [],
+            "responsible_id": "SISTEMA", "hash_version": HASH_V4_PIPELINED,
+        },
+        "hash": "4f9272e881b3601ef1b85689fcff322cb0a8c7b5fa20fb719c139df14dd0a0db",
+    },
+    {
+        "name": "three-tx-v4",
+        "block": {
+            "index": 7, "previous_hash": "cd" * 32, "timestamp": "2025-11-29 05:10:00",
+            "leader": "validator_1", "stage_name": "Transporte",
+            "transactions": [_VECTOR_TX, dict(_VECTOR_TX, sender="maria"), dict(_VECTOR_TX, timestamp="2025-11-29 05:09:59")],
+            "responsible_id": "", "hash_version": HASH_V4_PIPELINED,
+        },
+        "hash": "3584d6aa41fbbc6911c00e42aaeaa34cd27d761f138dc78e5548a170452733d8",
+    },
+    {
+        "name": "genesis-v3",
+        "block": {
+            "index": 0, "previous_hash": "0" * 64, "timestamp": "2025-11-29 05:00:00",
+            "leader": "SISTEMA", "stage_name": "Genesis", "transactions": [],
+            "responsible_id": "SISTEMA", "hash_version": HASH_V3_MERKLE,
+        },
+        "hash": "d447313a6fa0a2f60e796d70b5cd41a14f5f26ae9574e46ceb5a6e3e826c1e3c",
+    },
+    {
+        "name": "three-tx-v3",
+        "block": {
+            "index": 7, "previous_hash": "cd" * 32, "timestamp": "2025-11-29 05:10:00",
+            "leader": "validator_1", "stage_name": "Transporte",
+            "transactions": [_VECTOR_TX, dict(_VECTOR_TX, sender="maria"), dict(_VECTOR_TX, timestamp="2025-11-29 05:09:59")],
+            "responsible_id": "", "hash_version": HASH_V3_MERKLE,
+        },
+        "hash": "e8d4176c70301f62590cb7ae14439ad270bedfc80e309c72ae77592e63ad66a7",
+    },
+    {
+        "name": "genesis-v2",
+        "block": {
+            "index": 0, "previous_hash": "0" * 64, "timestamp": "2025-11-29 05:00:00",
+            "leader": "SISTEMA", "stage_name": "Genesis", "transactions": [],
+            "responsible_id": "SISTEMA", "hash_version": HASH_V2_CANONICAL,
+        },
+        "hash": "70fca9e991bfb3e06456986556e649bd5d63c55902fc6da838652c8a6b6701e8",
+    },
+    {
+        "name": "one-tx-v2",
+        "block": {
+            "index": 1, "previous_hash": "ab" * 32, "timestamp": "2025-11-29 05:04:02",
+            "leader": "validator_2", "stage_name": "Cosecha", "transactions": [_VECTOR_TX],
+            "responsible_id": "", "hash_version": HASH_V2_CANONICAL,
+        },
+        "hash": "fe76bdc13b9ea1a99444195e13dda387bb1b4e32b255faba15aa05d644a14465",
+    },
+    {
+        "name": "one-tx-v1-legacy",
+        "block": {
+            "index": 1, "previous_hash": "ab" * 32, "timestamp": "2025-11-29 05:04:02",
+            "leader": "validator_2", "stage_name": "Cosecha", "transactions": [_VECTOR_TX],
+            "responsible_id": "", "hash_version": HASH_V1_JSON,
+        },
+        "hash": "dbbdea9441e97af467e0c13c3e97f83ce5c4596dbec69445b627da0e67cc6fb8",
+    },
+]
+
+
+def check_test_vectors(block_cls):
+    """Retorna la lista de vectores que no coinciden (vacía si todo está bien)."""
+    failed = []
+    for vector in HEADER_TEST_VECTORS:
+        fields = dict(vector["block"])
+        hash_version = fields.pop("hash_version")
+        block = block_cls(**fields)
+        block.hash_version = hash_version
+        if header_hash(block) != vector["hash"]:
+            failed.append(vector["name"])
+    return failed
+
+
+if __name__ == "__main__":
+    # python hashing.py -> comprueba los vectores de prueba
+    from blockchain import Block
+    failed = check_test_vectors(Block)
+    if failed:
+        raise SystemExit(f"Vectores que no coinciden: {', '.join(failed)}")
+    print(f"[HASH] {len(HEADER_TEST_VECTORS)} vectores de prueba correctos.")
@@ -0,0 +1,92 @@
+# json_cache.py
+import json
+import threading
+from collections import OrderedDict
+
+# ======== CACHÉ DE BLOQUES SERIALIZADOS ========
+# Un bloque sellado no cambia, así que su JSON canónico (to_dict compacto)
+# se calcula una sola vez: al sellarlo en el proceso escritor, o en la primera
+# lectura en un worker. Los endpoints arman sus respuestas concatenando estos
+# bytes en lugar de reconstruir dicts y re-codificar en cada petición.
+#
+# Cada bloque tiene dos formas: la compacta (respuestas de la API, NDJSON) y
+# la indentada de la descarga por defecto, ya desplazada 4 espacios para ir
+# como elemento del arreglo. La indentada se calcula en la primera descarga.
+#
+# La caché es un LRU acotado por bytes (no por número de bloques). Las
+# entradas se identifican por altura, forma y hash, así una altura nunca
+# devuelve los bytes de otro bloque.
+
+DEFAULT_BUDGET_BYTES = 64 * 1024 * 1024
+
+
+def encode_block_json(block, pretty=False) -> bytes:
+    """
+    JSON canónico de un bloque: la forma de Block.to_dict(), compacta. Con
+    pretty=True, indentado como elemento de json.dumps(cadena, indent=4).
+    """
+    if pretty:
+        return ("    " + json.dumps(block.to_dict(), indent=4, default=str).replace("\n", "\n    ")).encode()
+    return json.dumps(block.to_dict(), separators=(",", ":"), default=str).encode()
+
+
+class BlockJsonCache:
+    def __init__(self, budget_bytes=DEFAULT_BUDGET_BYTES):
+        self.budget_bytes = budget_bytes
+        self._entries = OrderedDict()   # (altura, pretty) -> (hash, bytes)
+        self._size = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, height, block_hash, pretty=False):
+        key = (height, pretty)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] != block_hash:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, height, block_hash, data: bytes, pretty=False):
+        if len(data) > self.budget_bytes:
+            return
+        key = (height, pretty)
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._size -= len(old[1])
+            self._entries[key] = (block_hash, data)
+            self._size += len(data)
+            while self._size > self.budget_bytes:
+                _, (_, evicted) = self._entries.popitem(last=False)
+                self._size -= len(evicted)
+
+    def add_block(self, block):
+        """Llena la caché con un bloque recién sellado."""
+        self.put(block.index, block.block_hash, encode_block_json(block))
+
+    def block_bytes(self, view, height, pretty=False) -> bytes:
+        """JSON canónico (o indentado) del bloque height de la vista, desde la caché si está."""
+        block_hash = view.block_hash(height)
+        data = self.get(height, block_hash, pretty)
+        if data is None:
+            data = encode_block_json(view[height], pretty)
+            self.put(height, block_hash, data, pretty)
+        return data
+
+    def stats(self):
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": self._size,
+                "budget_bytes": self.budget_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+            }
+
+
+# Caché compartida por todos los endpoints de lectura de este proceso
+block_json = BlockJsonCache()
@@ -0,0 +1,221 @@
+# keystore.py
+import os
+import json
+
+import nacl.pwhash
+import nacl.secret
+import nacl.utils
+from nacl.exceptions import CryptoError
+from nacl.signing import SigningKey
+
+from blockchain import Node, EpochKeys
+from block_log import atomic_write
+
+# ======== ALMACÉN DE CLAVES DE LOS NODOS ========
+# Las claves privadas de los nodos se guardan cifradas con una frase de paso
+# local: la clave de cifrado se deriva con Argon2id (sal aleatoria por
+# archivo) y cada semilla Ed25519 va en su propio SecretBox (XSalsa20-Poly1305).
+# Las claves públicas se guardan en claro, agrupadas por época: la época
+# rige desde una altura de la cadena y es la que se usa para verificar los
+# certificados de esos bloques, aunque después se roten las claves.
+#
+#   {
+#     "version": 1,
+#     "kdf": {"salt": hex, "opslimit": int, "memlimit": int},
+#     "nodes": [{"id", "is_validator", "certificate", "public", "secret"}],
+#     "epochs": [{"from_height": int, "keys": {validator_id: clave pública hex}}]
+#   }
+
+KEYSTORE_VERSION = 1
+KEYSTORE_PATH = "keystore.json"
+PASSPHRASE_ENV = "BLOCKCHAIN_KEYSTORE_PASSPHRASE"
+VALIDATORS_ENV = "BLOCKCHAIN_VALIDATORS"
+DEV_ENV = "BLOCKCHAIN_KEYSTORE_DEV"          # "1": usar la frase de desarrollo (solo pruebas locales)
+DEV_PASSPHRASE = "blockchain-pf-dev"
+
+
+class Keystore:
+    def __init__(self, path, passphrase=None):
+        self.path = path
+        if passphrase is None:
+            passphrase = os.environ.get(PASSPHRASE_ENV)
+        if passphrase is None:
+            # Sin frase de paso no se arranca: la frase de desarrollo es pública
+            # y solo se usa si se pide explícitamente.
+            if os.environ.get(DEV_ENV) != "1":
+                raise ValueError(f"{PASSPHRASE_ENV} no está definida (para pruebas locales "
+                                 f"defina {DEV_ENV}=1 y se usará la frase de desarrollo)")
+            print(f"[KEYSTORE] {DEV_ENV}=1: se usa la frase de desarrollo; no usar en producción.")
+            passphrase = DEV_PASSPHRASE
+        self._passphrase = passphrase.encode()
+        self.data = None
+
+    def exists(self):
+        return os.path.exists(self.path)
+
+    def _box(self, kdf):
+        key = nacl.pwhash.argon2id.kdf(
+            nacl.secret.SecretBox.KEY_SIZE, self._passphrase, bytes.fromhex(kdf["salt"]),
+            opslimit=kdf["opslimit"], memlimit=kdf["memlimit"],
+        )
+        return nacl.secret.SecretBox(key)
+
+    def load(self):
+        """Descifra las claves. Retorna (validators, others) como en setup_network."""
+        with open(self.path, "r") as f:
+            self.data = json.load(f)
+        if self.data.get("version") != KEYSTORE_VERSION:
+            raise ValueError(f"Versión de keystore no soportada: {self.data.get('version')}")
+        box = self._box(self.data["kdf"])
+        validators, others = [], []
+        for entry in self.data["nodes"]:
+            try:
+                seed = box.decrypt(bytes.fromhex(entry["secret"]))
+            except CryptoError:
+                raise ValueError("Frase de paso incorrecta o keystore alterado") from None
+            sk = SigningKey(seed)
+            if sk.verify_key.encode().hex() != entry["public"]:
+                raise ValueError(f"La clave pública de {entry['id']} no coincide con su clave privada")
+            node = Node(entry["id"], entry["is_validator"], sk, sk.verify_key, entry["certificate"])
+            (validators if node.is_validator else others).append(node)
+        print(f"[KEYSTORE] {len(validators)} validadores y {len(others)} nodos cargados de {self.path}")
+        return validators, others
+
+    def create(self, validators, others, from_height=0):
+        """Cifra y guarda las claves; la primera época rige desde from_height."""
+        kdf = {
+            "salt": nacl.utils.random(nacl.pwhash.argon2id.SALTBYTES).hex(),
+            "opslimit": nacl.pwhash.argon2id.OPSLIMIT_INTERACTIVE,
+            "memlimit": nacl.pwhash.argon2id.MEMLIMIT_INTERACTIVE,
+        }
+        box = self._box(kdf)
+        self.data = {
+            "version": KEYSTORE_VERSION,
+            "kdf": kdf,
+            "nodes": [
+                {
+                    "id": n.id,
+                    "is_validator": n.is_validator,
+                    "certificate": n.certificate,
+                    "public": n.public_hex(),
+                    "secret": box.encrypt(n.signing_key.encode()).hex(),
+                }
+                for n in validators + others
+            ],
+            "epochs": [{"from_height": from_height, "keys": {v.id: v.public_hex() for v in validators}}],
+        }
+        self._save()
+        print(f"[KEYSTORE] Claves nuevas guardadas en {self.path} (época 0 desde la altura {from_height})")
+
+    def add_epoch(self, validators, from_height):
+        """
+        Rota las claves de los validadores: las nuevas reemplazan a las
+        anteriores en "nodes" (los demás nodos se conservan) y se agrega una
+        época que rige desde from_height. Las épocas anteriores quedan igual,
+        así los bloques ya sellados se siguen verificando con sus claves.
+        from_height es el largo actual de la cadena: si coincide con el inicio
+        de la última época, esa época no selló ningún bloque y se reemplaza.
+        Requiere haber llamado a load() (confirma la frase de paso).
+        """
+        if self.data is None:
+            raise ValueError("El keystore debe cargarse antes de agregar una época")
+        epochs = self.data["epochs"]
+        last = epochs[-1]["from_height"]
+        if from_height < last:
+            raise ValueError(f"La nueva época no puede empezar antes de la altura {last} (se pidió {from_height})")
+        if from_height == last:
+            epochs.pop()
+        box = self._box(self.data["kdf"])
+        others = [entry for entry in self.data["nodes"] if not entry["is_validator"]]
+        self.data["nodes"] = [
+            {
+                "id": v.id,
+                "is_validator": True,
+                "certificate": v.certificate,
+                "public": v.public_hex(),
+                "secret": box.encrypt(v.signing_key.encode()).hex(),
+            }
+            for v in validators
+        ] + others
+        epochs.append({"from_height": from_height, "keys": {v.id: v.public_hex() for v in validators}})
+        self._save()
+        print(f"[KEYSTORE] Época {len(epochs) - 1} con {len(validators)} validadores "
+              f"desde la altura {from_height} guardada en {self.path}")
+
+    def _save(self):
+        atomic_write(self.path, json.dumps(self.data, indent=2).encode())
+        os.chmod(self.path, 0o600)
+
+    def epoch_keys(self) -> EpochKeys:
+        return EpochKeys.from_json(self.data)
+
+
+def validator_ids(path=KEYSTORE_PATH):
+    """IDs de los validadores de la última época (parte pública, sin frase de paso)."""
+    try:
+        with open(path, "r") as f:
+            epochs = json.load(f)["epochs"]
+    except (OSError, ValueError, KeyError):
+        return []
+    return list(epochs[-1]["keys"]) if epochs else []
+
+
+def validator_count(default=5):
+    """Número de validadores de una red nueva (BLOCKCHAIN_VALIDATORS), validado."""
+    value = os.environ.get(VALIDATORS_ENV, str(default))
+    try:
+        k = int(value)
+    except ValueError:
+        raise ValueError(f"{VALIDATORS_ENV} debe ser un entero, se recibió {value!r}") from None
+    if k < 1:
+        raise ValueError(f"{VALIDATORS_ENV} debe ser al menos 1, se recibió {k}")
+    return k
+
+
+# ======== CLI ========
+# Rotación de claves con el servidor detenido: genera validadores nuevos y
+# agrega una época que rige desde la altura actual de la cadena (el próximo
+# bloque). Al volver a arrancar, el servidor firma con las claves nuevas.
+#
+#   python keystore.py rotate --data blockchain_data [--validators N]
+
+def main(argv=None):
+    import argparse
+    from blockchain import setup_network
+    from verify import open_store
+
+    parser = argparse.ArgumentParser(description="Administración del keystore de validadores")
+    sub = parser.add_subparsers(dest="command", required=True)
+    rotate = sub.add_parser("rotate", help="rota las claves de los validadores desde la altura actual")
+    rotate.add_argument("--keys", default=KEYSTORE_PATH, help="keystore.json")
+    rotate.add_argument("--data", default="blockchain_data", help="directorio de la cadena")
+    rotate.add_argument("--validators", type=int, default=None,
+                        help="número de validadores de la nueva época (por defecto, el mismo)")
+    args = parser.parse_args(argv)
+
+    try:
+        keystore = Keystore(args.keys)
+        validators, _ = keystore.load()
+    except ValueError as e:
+        print(f"[KEYSTORE] {e}")
+        return 1
+    k = args.validators if args.validators is not None else len(validators)
+    if k < 1:
+        parser.error("--validators debe ser al menos 1")
+    store = open_store(args.data)
+    try:
+        height = len(store)
+    finally:
+        store.close()
+    new_validators, _ = setup_network(k_validators=k, extra_nodes=0)
+    try:
+        keystore.add_epoch(new_validators, from_height=height)
+    except ValueError as e:
+        print(f"[KEYSTORE] {e}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    import sys
+    sys.exit(main())
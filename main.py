@@ -1,25 +1,40 @@
 # main.py
+import asyncio
+from contextlib import asynccontextmanager
+from typing import List, Optional
+from pydantic import BaseModel
 from fastapi import FastAPI, Request, Form, Depends
-from fastapi.responses import HTMLResponse, RedirectResponse
+from fastapi.responses import HTMLResponse, RedirectResponse, StreamingResponse, Response
 from fastapi.templating import Jinja2Templates
 from fastapi import HTTPException
-import json  # <--- NUEVO
-from fastapi import Response  # <--- CAMBIO: Usaremos Response en vez de JSONResponse
-from block_ops import chain_as_dict
 
 from auth.auth import authenticate
 from auth.deps import role_usuario, role_autoridad
 from blockchain import Transaction
-from block_ops import (
-    propose_block_from_tx,
-    list_pending_blocks,
-    sign_pending_block,
-    chain_as_dict
-)
-from state import pending_blocks, chain
+from queries import (chain_page, chain_page_json, export_chain, transaction_proof, batch_history,
+                     indexed_transactions, time_range)
+from offload import loop_lag
+import service
 from fastapi.encoders import jsonable_encoder
 
-app = FastAPI()
+# Estado de consenso: en este proceso, o en el coordinador compartido si
+# BLOCKCHAIN_COORDINATOR apunta a su socket (varios workers de uvicorn)
+consensus = service.connect()
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Tareas de fondo del dueño del estado: corte de lotes del mempool por
+    # linger y rechazo de propuestas vencidas (en modo coordinador, ninguna)
+    tasks = [asyncio.create_task(coro) for coro in consensus.background_tasks()]
+    # Medición del atraso del event loop (ver /metrics)
+    tasks.append(asyncio.create_task(loop_lag.run()))
+    yield
+    for task in tasks:
+        task.cancel()
+
+
+app = FastAPI(lifespan=lifespan)
 templates = Jinja2Templates(directory="./templates")
 
 
@@ -80,31 +95,29 @@ async def submit_form(
         # si tienes más campos, déjalos igual
     )
 
-    pending = propose_block_from_tx(tx)
-    print(">> Nuevo bloque propuesto:", pending)
+    pending_id = await consensus.submit_transaction(tx)
+    if pending_id:
+        print(">> Nuevo bloque propuesto:", pending_id)
+    else:
+        print(">> Transacción en el mempool")
 
     return RedirectResponse("/form?msg=success", status_code=303)
 
 
 
 # ---------- AUTORIDADES: VALIDACIÓN ----------
-from block_ops import (
-    propose_block_from_tx,
-    list_pending_blocks,
-    sign_pending_block,
-    chain_as_dict
-)
-# ...
 
 @app.get("/pendientes", response_class=HTMLResponse)
-async def revisar_pendientes(request: Request, user=Depends(role_autoridad)):
-    pendientes_limpios = list_pending_blocks()
+async def revisar_pendientes(request: Request, sin_firmar: bool = False, user=Depends(role_autoridad)):
+    # ?sin_firmar=1 -> solo las propuestas que este validador aún no firmó
+    pendientes_limpios = await consensus.list_pending_blocks(user.username if sin_firmar else None)
     return templates.TemplateResponse(
         "pendientes.html",
         {
             "request": request,
             "user": user,
-            "pendientes": pendientes_limpios
+            "pendientes": pendientes_limpios,
+            "sin_firmar": sin_firmar
         }
     )
 
@@ -118,11 +131,11 @@ async def firmar_bloque(
 ):
     """
     Endpoint llamado por el botón 'Firmar' del template pendientes.html.
-    user.username debe coincidir con el id del validador (validator_1 ... validator_5).
+    user.username debe coincidir con el id del validador (validator_1 ... validator_k, según el keystore).
     """
     validator_id = user.username  # mapeo simple: username == validator_id
     try:
-        result = sign_pending_block(pending_id, validator_id)
+        result = await consensus.sign_pending_block(pending_id, validator_id)
     except HTTPException as e:
         # si block_ops lanza HTTPException, lo mostramos (puedes mejorar la UI luego)
         print("Error al firmar:", e.detail)
@@ -136,32 +149,63 @@ async def firmar_bloque(
     return RedirectResponse("/pendientes", status_code=303)
 
 
-#-------- Mostrar Blockchain ----------#
+class FirmaLote(BaseModel):
+    ids: List[int] = []
+    desde: Optional[int] = None
+    hasta: Optional[int] = None
+    todas: bool = False     # todas las propuestas que el validador aún no firmó
+
+
+@app.post("/firmar_lote")
+async def firmar_lote(
+    pending_ids: List[int] = Form([]),
+    desde: Optional[int] = Form(None),
+    hasta: Optional[int] = Form(None),
+    todas: bool = Form(False),
+    user=Depends(role_autoridad)
+):
+    """Firma en lote desde pendientes.html (casillas seleccionadas o 'Validar todas')."""
+    ids = await consensus.resolve_pending_ids(pending_ids, desde, hasta, user.username, todas)
+    try:
+        result = await consensus.sign_pending_blocks(ids, user.username)
+    except HTTPException as e:
+        print("Error al firmar en lote:", e.detail)
+        return RedirectResponse("/pendientes?msg=error", status_code=303)
 
-# ...
+    print(f"Resultado firma en lote: {len(result['signed'])} firmadas, "
+          f"{len(result['accepted'])} selladas, {len(result['skipped'])} omitidas")
+    return RedirectResponse("/pendientes", status_code=303)
 
-from block_ops import (
-    propose_block_from_tx,
-    list_pending_blocks,
-    sign_pending_block,
-    chain_as_dict,
-)
-# ...
+
+@app.post("/api/firmar_lote")
+async def firmar_lote_json(lote: FirmaLote, user=Depends(role_autoridad)):
+    """Versión JSON: {"ids": [...]} o {"desde": a, "hasta": b} o {"todas": true}."""
+    ids = await consensus.resolve_pending_ids(lote.ids, lote.desde, lote.hasta, user.username, lote.todas)
+    return await consensus.sign_pending_blocks(ids, user.username)
+
+
+#-------- Mostrar Blockchain ----------#
 
 @app.get("/chain", response_class=HTMLResponse)
-def view_chain(request: Request):
-    chain_json = chain_as_dict()  # incluye hash, certificate, etc.
+def view_chain(request: Request, cursor: Optional[str] = None, orden: str = "desc"):
+    # Solo la página pedida (más recientes primero); cada bloque incluye hash, certificate, etc.
+    page = chain_page(consensus.chain_view(), cursor, orden)
     return templates.TemplateResponse(
         "chain.html",
         {
             "request": request,
-            "chain": chain_json,
+            "chain": page["blocks"],
+            "page": page,
         }
     )
 
 
-from block_ops import mark_pending_block_failed
-# ...
+@app.get("/api/chain")
+def view_chain_json(cursor: Optional[str] = None, orden: str = "desc"):
+    """Versión JSON del explorador: blocks, next_cursor y prev_cursor."""
+    return Response(content=chain_page_json(consensus.chain_view(), cursor, orden),
+                    media_type="application/json")
+
 
 @app.post("/rechazar")
 async def rechazar_bloque(
@@ -169,7 +213,7 @@ async def rechazar_bloque(
     user=Depends(role_autoridad)
 ):
     try:
-        result = mark_pending_block_failed(pending_id)
+        result = await consensus.mark_pending_block_failed(pending_id)
         print("Resultado rechazo:", result)
     except HTTPException as e:
         print("Error al rechazar:", e.detail)
@@ -182,16 +226,56 @@ async def rechazar_bloque(
 
 
 
+@app.get("/chain/{height}/tx/{tx_index}/proof")
+def transaction_inclusion_proof(height: int, tx_index: int):
+    """Prueba de inclusión (Merkle) de una transacción, para auditores."""
+    return transaction_proof(consensus.chain_view(), height, tx_index)
+
+
+@app.get("/batch/{batch_id}/history")
+def historial_lote(batch_id: str):
+    """Trazabilidad de un lote: sus transacciones en orden de altura (vía índice)."""
+    return batch_history(consensus.chain_view(), consensus.chain_index(), batch_id)
+
+
+@app.get("/index/{field}/{value}")
+def buscar_por_indice(field: str, value: str):
+    """Transacciones por etapa (stage), responsable (responsible), emisor (sender) o lote (batch)."""
+    return indexed_transactions(consensus.chain_view(), consensus.chain_index(), field, value)
+
+
+@app.get("/range")
+def consulta_por_rango(desde: str, hasta: str, tipo: str = "blocks",
+                       cursor: Optional[str] = None, limit: int = 100):
+    """
+    Bloques (tipo=blocks) o transacciones (tipo=transactions) entre dos
+    instantes, paginados con next_cursor. Para los reportes de auditoría.
+    """
+    return time_range(consensus.chain_view(), consensus.chain_index(), desde, hasta, tipo, cursor, limit)
+
+
 @app.get("/download_chain")
-def download_chain_file():
-    """Genera un archivo JSON descargable y BONITO (pretty-printed)"""
-    data = chain_as_dict()
-    
-    # Aquí está el truco: indent=4 hace que se vea estructurado
-    pretty_json_str = json.dumps(data, indent=4, default=str)
-    
-    return Response(
-        content=pretty_json_str,
-        media_type="application/json",
-        headers={"Content-Disposition": "attachment; filename=blockchain_data.json"}
+def download_chain_file(formato: str = "json", gzip: bool = False, pretty: bool = True):
+    """
+    Descarga la cadena en streaming: arreglo JSON BONITO (indentado, por
+    defecto) o NDJSON (?formato=ndjson), desde la caché de bloques
+    serializados; ?pretty=0 da el arreglo compacto y ?gzip=1 lo comprime.
+    """
+    chunks = export_chain(consensus.chain_view(), formato, gzip, pretty)
+    filename = "blockchain_data." + ("ndjson" if formato == "ndjson" else "json")
+    media_type = "application/x-ndjson" if formato == "ndjson" else "application/json"
+    if gzip:
+        filename += ".gz"
+        media_type = "application/gzip"
+    return StreamingResponse(
+        chunks,
+        media_type=media_type,
+        headers={"Content-Disposition": f"attachment; filename={filename}"}
     )
+
+
+# ---------- MÉTRICAS ----------
+@app.get("/metrics")
+async def metrics():
+    """Atraso del event loop y tamaño de las colas internas."""
+    return await consensus.metrics()
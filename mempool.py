@@ -0,0 +1,90 @@
+# mempool.py
+import time
+import asyncio
+import threading
+from typing import List, Dict, Any, Optional
+
+import hashing
+
+# ======== MEMPOOL ========
+# Las transacciones de POST /form se acumulan aquí y se cortan en un bloque
+# cuando se alcanza un número de transacciones, un tamaño en bytes, o cuando
+# vence el tiempo de espera (linger) desde la primera transacción del lote.
+# Así una sola ronda de consenso y un solo commit cubren muchos eventos.
+
+DEFAULT_MAX_TXS = 100
+DEFAULT_MAX_BYTES = 256 * 1024
+DEFAULT_LINGER_SECONDS = 2.0
+
+
+class Mempool:
+    def __init__(self, max_txs=DEFAULT_MAX_TXS, max_bytes=DEFAULT_MAX_BYTES,
+                 linger_seconds=DEFAULT_LINGER_SECONDS):
+        self.max_txs = max_txs
+        self.max_bytes = max_bytes
+        self.linger_seconds = linger_seconds
+        self._txs: List[Dict[str, Any]] = []
+        self._bytes = 0
+        self._first_at: Optional[float] = None
+        self._lock = threading.Lock()
+        self._wakeup = asyncio.Event()
+
+    def __len__(self):
+        return len(self._txs)
+
+    def add(self, tx: dict) -> Optional[List[dict]]:
+        """
+        Agrega una transacción. Si con ella se llena el lote (por cantidad o
+        por bytes) retorna el lote cortado para proponerlo de inmediato.
+        """
+        size = len(hashing.encode_transaction(tx))
+        with self._lock:
+            if not self._txs:
+                self._first_at = time.monotonic()
+                self._wakeup.set()   # arranca el plazo de linger
+            self._txs.append(tx)
+            self._bytes += size
+            if len(self._txs) >= self.max_txs or self._bytes >= self.max_bytes:
+                return self._cut()
+        return None
+
+    def deadline(self) -> Optional[float]:
+        """Momento (time.monotonic) en que vence el lote actual, o None si está vacío."""
+        first = self._first_at
+        return None if first is None else first + self.linger_seconds
+
+    def cut_expired(self) -> Optional[List[dict]]:
+        with self._lock:
+            if self._txs and time.monotonic() >= self._first_at + self.linger_seconds:
+                return self._cut()
+        return None
+
+    def _cut(self):
+        batch = self._txs
+        self._txs = []
+        self._bytes = 0
+        self._first_at = None
+        return batch
+
+    async def wait_for_work(self):
+        await self._wakeup.wait()
+        self._wakeup.clear()
+
+
+async def run_linger_loop(mempool: Mempool, propose):
+    """Tarea de fondo: corta el lote cuando vence su plazo y espera a propose(batch)."""
+    while True:
+        deadline = mempool.deadline()
+        if deadline is None:
+            await mempool.wait_for_work()
+            continue
+        delay = deadline - time.monotonic()
+        if delay > 0:
+            await asyncio.sleep(delay)
+            continue
+        batch = mempool.cut_expired()
+        if batch:
+            try:
+                await propose(batch)
+            except Exception as e:
+                print(f"[MEMPOOL] Error al proponer el lote: {e}")
@@ -0,0 +1,60 @@
+# merkle.py
+import hashlib
+
+# ======== ÁRBOL DE MERKLE DE TRANSACCIONES ========
+# Nodo interno = sha256(b"\x01" || izquierdo || derecho). Las hojas llevan el
+# prefijo b"\x00" (ver hashing.transaction_leaf), así una hoja nunca puede
+# hacerse pasar por un nodo interno. Si un nivel tiene un número impar de
+# nodos, el último sube sin cambios (no se duplica).
+
+NODE_PREFIX = b"\x01"
+EMPTY_ROOT = hashlib.sha256(b"").digest()
+
+LEFT = "L"      # el hermano va a la izquierda del hash acumulado
+RIGHT = "R"     # el hermano va a la derecha
+
+
+def _node(left: bytes, right: bytes) -> bytes:
+    return hashlib.sha256(NODE_PREFIX + left + right).digest()
+
+
+def merkle_root(leaves) -> bytes:
+    if not leaves:
+        return EMPTY_ROOT
+    level = list(leaves)
+    while len(level) > 1:
+        nxt = [_node(level[i], level[i + 1]) for i in range(0, len(level) - 1, 2)]
+        if len(level) % 2:
+            nxt.append(level[-1])
+        level = nxt
+    return level[0]
+
+
+def merkle_proof(leaves, index: int):
+    """Hermanos desde la hoja hasta la raíz: lista de (lado, hash)."""
+    if not 0 <= index < len(leaves):
+        raise IndexError("índice de hoja fuera de rango")
+    proof = []
+    level = list(leaves)
+    while len(level) > 1:
+        sibling = index ^ 1
+        if sibling < len(level):
+            proof.append((LEFT if sibling < index else RIGHT, level[sibling]))
+        nxt = [_node(level[i], level[i + 1]) for i in range(0, len(level) - 1, 2)]
+        if len(level) % 2:
+            nxt.append(level[-1])
+        level = nxt
+        index //= 2
+    return proof
+
+
+def root_from_proof(leaf: bytes, proof) -> bytes:
+    """Recalcula la raíz con O(log n) hashes a partir de la hoja y la prueba."""
+    acc = leaf
+    for side, sibling in proof:
+        acc = _node(sibling, acc) if side == LEFT else _node(acc, sibling)
+    return acc
+
+
+def verify_proof(leaf: bytes, proof, root: bytes) -> bool:
+    return root_from_proof(leaf, proof) == root
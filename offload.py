@@ -0,0 +1,66 @@
+# offload.py
+import os
+import time
+import asyncio
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+# ======== TRABAJO FUERA DEL EVENT LOOP ========
+# El loop de asyncio solo coordina: la criptografía (firmar, verificar,
+# raíces de Merkle) corre en un pool de hilos y la escritura a disco en el
+# hilo del escritor de la cadena (chain_writer.py). PyNaCl libera el GIL
+# durante las operaciones de libsodium, así que el pool aprovecha varios
+# núcleos y el loop sigue atendiendo /login y el resto de peticiones.
+
+CRYPTO_WORKERS = os.cpu_count() or 1
+LAG_INTERVAL_SECONDS = 0.1
+LAG_WINDOW = 600                # muestras recientes (~1 minuto con el intervalo por defecto)
+
+crypto_pool = ThreadPoolExecutor(max_workers=CRYPTO_WORKERS, thread_name_prefix="crypto")
+
+
+async def run_crypto(fn, *args):
+    """Ejecuta fn(*args) en el pool criptográfico y espera su resultado."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(crypto_pool, fn, *args)
+
+
+class LoopLagMonitor:
+    """
+    Mide cuánto se atrasa el event loop: duerme un intervalo fijo y registra
+    el exceso sobre lo pedido. Si algún handler bloquea el loop, el atraso
+    aparece aquí (y en /metrics).
+    """
+
+    def __init__(self, interval=LAG_INTERVAL_SECONDS, window=LAG_WINDOW):
+        self.interval = interval
+        self._samples = deque(maxlen=window)
+        self.max_lag = 0.0
+
+    async def run(self):
+        while True:
+            started = time.perf_counter()
+            await asyncio.sleep(self.interval)
+            lag = max(0.0, time.perf_counter() - started - self.interval)
+            self._samples.append(lag)
+            self.max_lag = max(self.max_lag, lag)
+
+    def stats(self):
+        samples = sorted(self._samples)
+        if not samples:
+            return {"samples": 0}
+
+        def pct(p):
+            return samples[min(len(samples) - 1, int(p * len(samples)))] * 1000
+
+        return {
+            "samples": len(samples),
+            "last_ms": self._samples[-1] * 1000,
+            "p50_ms": pct(0.50),
+            "p99_ms": pct(0.99),
+            "max_recent_ms": samples[-1] * 1000,
+            "max_ms": self.max_lag * 1000,
+        }
+
+
+loop_lag = LoopLagMonitor()
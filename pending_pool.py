@@ -0,0 +1,94 @@
+# pending_pool.py
+import threading
+from typing import Dict, Any, Optional, Tuple
+
+# ======== POOL DE PROPUESTAS PENDIENTES ========
+# Las propuestas en consenso se guardan en un dict id -> entrada: la búsqueda
+# y la eliminación al sellar son O(1) y la iteración respeta el orden de
+# llegada (los dict de Python conservan el orden de inserción).
+#
+# Para cada validador se mantiene además el conjunto ordenado de propuestas
+# que todavía no firmó, así su vista "pendientes de mi firma" no recorre todo
+# el pool. Las instantáneas para el HTML se cachean hasta la siguiente
+# modificación, de modo que refrescar el panel no copia el pool cada vez.
+#
+# Las aprobaciones de cada entrada (pb["approvals"]) son un quorum.Approvals
+# sobre las posiciones de su conjunto de validadores (pb["validators"]).
+
+
+def has_signed(pb, validator_id) -> bool:
+    pos = pb["validators"].position.get(validator_id)
+    return pos is not None and pos in pb["approvals"]
+
+
+class PendingPool:
+    def __init__(self, validator_ids=()):
+        self._entries: Dict[int, Dict[str, Any]] = {}
+        self._unsigned: Dict[str, Dict[int, None]] = {vid: {} for vid in validator_ids}
+        self._next_id = 1
+        self._snapshot: Optional[Tuple[Dict[str, Any], ...]] = None
+        # Protege el pool; las aprobaciones de cada entrada las protege su propio lock (pb["lock"])
+        self.lock = threading.RLock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, pending_id):
+        return pending_id in self._entries
+
+    def __iter__(self):
+        return iter(self.snapshot())
+
+    def next_id(self) -> int:
+        """Reserva el id de la siguiente propuesta."""
+        with self.lock:
+            pid = self._next_id
+            self._next_id += 1
+            return pid
+
+    def add(self, pb: Dict[str, Any]):
+        with self.lock:
+            pid = pb["id"]
+            self._entries[pid] = pb
+            for vid, unsigned in self._unsigned.items():
+                if not has_signed(pb, vid):
+                    unsigned[pid] = None
+            self._snapshot = None
+
+    def get(self, pending_id) -> Optional[Dict[str, Any]]:
+        return self._entries.get(pending_id)
+
+    def remove(self, pending_id) -> Optional[Dict[str, Any]]:
+        """Saca la propuesta del pool (al sellarla o rechazarla)."""
+        with self.lock:
+            pb = self._entries.pop(pending_id, None)
+            if pb is not None:
+                for unsigned in self._unsigned.values():
+                    unsigned.pop(pending_id, None)
+                self._snapshot = None
+            return pb
+
+    def mark_signed(self, pending_id, validator_id):
+        """Quita la propuesta de la vista 'sin firmar' del validador."""
+        with self.lock:
+            unsigned = self._unsigned.get(validator_id)
+            if unsigned is not None:
+                unsigned.pop(pending_id, None)
+
+    def unsigned_by(self, validator_id):
+        """Propuestas que el validador aún no firmó, en orden de llegada."""
+        with self.lock:
+            unsigned = self._unsigned.get(validator_id)
+            if unsigned is None:
+                return [pb for pb in self.snapshot() if not has_signed(pb, validator_id)]
+            return [self._entries[pid] for pid in unsigned]
+
+    def snapshot(self) -> Tuple[Dict[str, Any], ...]:
+        """Copia inmutable del orden actual; se reutiliza hasta el próximo cambio."""
+        snap = self._snapshot
+        if snap is not None:
+            return snap     # camino sin lock: la tupla publicada nunca cambia
+        with self.lock:
+            if self._snapshot is None:
+                self._snapshot = tuple(self._entries.values())
+            return self._snapshot
@@ -0,0 +1,275 @@
+# queries.py
+import json
+import zlib
+import base64
+from datetime import datetime
+
+from fastapi import HTTPException
+
+import hashing
+import merkle
+from chain_index import INDEX_FIELDS
+from json_cache import block_json
+
+# ======== CONSULTAS DE LECTURA ========
+# Funciones de solo lectura sobre una vista de la cadena (chain.snapshot() en
+# el proceso escritor, o el almacén en solo lectura de un worker). No
+# importan state.py, así que sirven en cualquier proceso. Los bloques
+# completos se entregan desde la caché de JSON serializado (json_cache).
+
+
+# Los cursores de paginación son opacos para el cliente: enteros (alturas o
+# claves del índice) codificados en base64 URL.
+
+def encode_cursor(*parts) -> str:
+    return base64.urlsafe_b64encode(":".join(map(str, parts)).encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str, n: int):
+    """Partes enteras de un cursor opaco; 400 si no es válido."""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+        parts = [int(p) for p in raw.split(":")]
+    except ValueError:
+        parts = None
+    if not parts or len(parts) != n:
+        raise HTTPException(status_code=400, detail="Cursor inválido")
+    return parts
+
+
+CHAIN_PAGE_SIZE = 25
+CHAIN_ORDERS = ("desc", "asc")
+
+
+EXPORT_FORMATS = ("json", "ndjson")
+EXPORT_CHUNK_BYTES = 64 * 1024
+
+
+def _export_pieces(view, fmt, pretty):
+    if fmt == "ndjson":
+        for h in range(len(view)):
+            yield block_json.block_bytes(view, h) + b"\n"
+        return
+    if not len(view):
+        yield b"[]"
+        return
+    # Indentado: mismo texto que json.dumps([b.to_dict() for b in view], indent=4)
+    sep, between, end = (b"[\n", b",\n", b"\n]") if pretty else (b"[", b",", b"]")
+    for h in range(len(view)):
+        yield sep + block_json.block_bytes(view, h, pretty)
+        sep = between
+    yield end
+
+
+def export_chain(view, fmt="json", gzip=False, pretty=True):
+    """
+    Genera la exportación de la cadena en trozos de ~EXPORT_CHUNK_BYTES:
+    arreglo JSON o NDJSON armados con los bytes en caché de cada bloque,
+    opcionalmente comprimidos con gzip al vuelo. El arreglo es indentado
+    salvo con pretty=False (NDJSON siempre es compacto). Solo hay en memoria el trozo
+    en curso, así que el consumo no crece con la cadena y el primer byte
+    sale de inmediato.
+    """
+    if fmt not in EXPORT_FORMATS:
+        raise HTTPException(status_code=400, detail=f"Formato inválido: {fmt}")
+
+    def chunks():
+        compressor = zlib.compressobj(wbits=31) if gzip else None   # 31 = contenedor gzip
+        buf, size = [], 0
+        for piece in _export_pieces(view, fmt, pretty):
+            buf.append(piece)
+            size += len(piece)
+            if size >= EXPORT_CHUNK_BYTES:
+                out = b"".join(buf)
+                buf, size = [], 0
+                out = compressor.compress(out) if compressor else out
+                if out:
+                    yield out
+        out = b"".join(buf)
+        if compressor:
+            out = compressor.compress(out) + compressor.flush()
+        if out:
+            yield out
+
+    return chunks()
+
+
+def _page_window(view, cursor, order):
+    """Alturas de la página y sus metadatos (orden, total y cursores)."""
+    if order not in CHAIN_ORDERS:
+        raise HTTPException(status_code=400, detail=f"Orden inválido: {order}")
+    total = len(view)
+    step = -1 if order == "desc" else 1
+    if cursor:
+        (start,) = decode_cursor(cursor, 1)
+        if not 0 <= start < total:
+            raise HTTPException(status_code=400, detail="Cursor fuera de la cadena")
+    else:
+        start = total - 1 if order == "desc" else 0
+    stop = max(start - CHAIN_PAGE_SIZE, -1) if order == "desc" else min(start + CHAIN_PAGE_SIZE, total)
+    heights = range(start, stop, step)
+
+    # Cursor de la página anterior: el inicio de la ventana previa en este orden
+    prev_start = start - step * CHAIN_PAGE_SIZE
+    first = total - 1 if order == "desc" else 0
+    if heights and start != first:
+        prev_start = min(prev_start, total - 1) if order == "desc" else max(prev_start, 0)
+        prev_cursor = encode_cursor(prev_start)
+    else:
+        prev_cursor = None
+    return heights, {
+        "order": order,
+        "total": total,
+        "next_cursor": encode_cursor(stop) if 0 <= stop < total else None,
+        "prev_cursor": prev_cursor,
+    }
+
+
+def chain_page(view, cursor=None, order="desc"):
+    """
+    Una página del explorador de /chain: CHAIN_PAGE_SIZE bloques desde la
+    altura del cursor, por defecto los más recientes primero. Los cursores
+    son alturas codificadas, así que una página no se corre cuando llegan
+    bloques nuevos, y solo se leen los bloques de la página.
+    """
+    heights, page = _page_window(view, cursor, order)
+    page["blocks"] = [json.loads(block_json.block_bytes(view, h)) for h in heights]
+    return page
+
+
+def chain_page_json(view, cursor=None, order="desc") -> bytes:
+    """chain_page ya serializada: concatena los bytes en caché de cada bloque."""
+    heights, page = _page_window(view, cursor, order)
+    head = json.dumps(page, separators=(",", ":")).encode()
+    blocks = b",".join(block_json.block_bytes(view, h) for h in heights)
+    return head[:-1] + b',"blocks":[' + blocks + b"]}"
+
+
+def transaction_proof(view, height: int, tx_index: int):
+    """
+    Prueba de inclusión de una transacción: la transacción, los hashes hermanos
+    del árbol de Merkle y la cabecera del bloque. Con esto un auditor recalcula
+    la raíz y el hash del bloque sin descargar el resto de transacciones.
+    """
+    if not 0 <= height < len(view):
+        raise HTTPException(status_code=404, detail="Bloque no encontrado")
+    block = view[height]
+    if not 0 <= tx_index < len(block.transactions):
+        raise HTTPException(status_code=404, detail="Transacción no encontrada")
+    if block.hash_version < hashing.HASH_V3_MERKLE:
+        raise HTTPException(status_code=409, detail="El bloque fue sellado sin raíz de Merkle")
+
+    leaves = [hashing.transaction_leaf(tx) for tx in block.transactions]
+    proof = merkle.merkle_proof(leaves, tx_index)
+    return {
+        "height": height,
+        "tx_index": tx_index,
+        "transaction": block.transactions[tx_index],
+        "leaf": leaves[tx_index].hex(),
+        "proof": [{"side": side, "hash": h.hex()} for side, h in proof],
+        "header": {
+            "hash_version": block.hash_version,
+            "index": block.index,
+            "previous_hash": block.previous_hash,
+            "transactions_root": merkle.merkle_root(leaves).hex(),
+            "timestamp": block.timestamp,
+            "leader": block.leader,
+            "stage_name": block.stage_name,
+            "responsible_id": block.responsible_id,
+            "nonce": block.nonce,
+        },
+        "block_hash": block.block_hash,
+        "certificate": block.certificate,
+    }
+
+
+def indexed_transactions(view, index, field: str, value: str):
+    """
+    Transacciones con field == value, en orden de altura, usando los índices
+    secundarios: solo se leen los bloques que contienen resultados.
+    """
+    if field not in INDEX_FIELDS:
+        raise HTTPException(status_code=400, detail=f"Campo no indexado: {field}")
+    result = []
+    block, block_height = None, -1
+    for height, tx_index in index.lookup(field, value, view):
+        if height != block_height:
+            block, block_height = view[height], height
+        result.append({
+            "height": height,
+            "tx_index": tx_index,
+            "block_hash": block.block_hash,
+            "block_timestamp": block.timestamp,
+            "status": block.certificate.get("status"),
+            "transaction": block.transactions[tx_index],
+        })
+    return result
+
+
+def batch_history(view, index, batch_id: str):
+    """Recorrido de un lote por la cadena de suministro, etapa por etapa."""
+    events = indexed_transactions(view, index, "batch", batch_id)
+    if not events:
+        raise HTTPException(status_code=404, detail="Lote no encontrado")
+    return {"batch": batch_id, "events": events}
+
+
+# ======== CONSULTAS POR RANGO DE TIEMPO ========
+
+RANGE_KINDS = ("blocks", "transactions")
+RANGE_MAX_LIMIT = 1000
+
+
+def parse_instant(value: str) -> int:
+    """Instante de consulta: segundos epoch o fecha ISO / "%Y-%m-%d %H:%M:%S" (hora local)."""
+    value = value.strip()
+    try:
+        if value.lstrip("-").isdigit():
+            return int(value)
+        return int(datetime.fromisoformat(value).timestamp())
+    except ValueError:
+        raise HTTPException(status_code=400, detail=f"Instante inválido: {value}") from None
+
+
+def time_range(view, index, desde: str, hasta: str, kind="blocks", cursor=None, limit=100):
+    """
+    Bloques o transacciones con marca de tiempo en [desde, hasta], en orden
+    cronológico, por páginas: next_cursor retoma justo después del último
+    resultado entregado. Ubicar el rango cuesta O(log n) y cada página lee
+    solo sus bloques.
+    """
+    if kind not in RANGE_KINDS:
+        raise HTTPException(status_code=400, detail=f"Tipo de rango inválido: {kind}")
+    if not 1 <= limit <= RANGE_MAX_LIMIT:
+        raise HTTPException(status_code=400, detail=f"limit debe estar entre 1 y {RANGE_MAX_LIMIT}")
+    start, end = parse_instant(desde), parse_instant(hasta)
+    after = decode_cursor(cursor, 3) if cursor else None
+    entries, more = index.time_range(kind, start, end, after, limit, view)
+
+    items = []
+    for ts, height, tx_index in entries:
+        block = view[height]
+        if kind == "blocks":
+            items.append({
+                "height": height,
+                "hash": block.block_hash,
+                "timestamp": block.timestamp,
+                "stage_name": block.stage_name,
+                "leader": block.leader,
+                "status": block.certificate.get("status"),
+                "tx_count": len(block.transactions),
+            })
+        else:
+            items.append({
+                "height": height,
+                "tx_index": tx_index,
+                "block_hash": block.block_hash,
+                "status": block.certificate.get("status"),
+                "transaction": block.transactions[tx_index],
+            })
+    return {
+        "desde": start,
+        "hasta": end,
+        "items": items,
+        "next_cursor": encode_cursor(*entries[-1]) if more else None,
+    }
@@ -0,0 +1,85 @@
+# quorum.py
+from typing import Dict, List, Tuple
+
+# ======== CONJUNTOS DE VALIDADORES Y CERTIFICADOS COMPACTOS ========
+# Un ValidatorSet es el conjunto ordenado de validadores de una época: la
+# posición de cada validador es su bit en los bitmaps de aprobación. Las
+# aprobaciones se guardan como un entero-bitmap más un arreglo de firmas
+# empaquetado en el orden de los bits, así contar el quórum es un popcount y
+# el tamaño no depende de la longitud de los IDs.
+
+SIGNATURE_SIZE = 64     # Ed25519
+
+
+class ValidatorSet:
+    def __init__(self, ids: List[str], verify_keys: List, q: int, epoch=0, from_height=0):
+        self.ids = list(ids)
+        self.keys = list(verify_keys)          # VerifyKey por posición
+        self.q = q
+        self.epoch = epoch
+        self.from_height = from_height
+        self.position = {vid: i for i, vid in enumerate(self.ids)}
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __contains__(self, validator_id):
+        return validator_id in self.position
+
+    def get(self, validator_id, default=None):
+        """VerifyKey del validador (interfaz de dict, para verify_block)."""
+        i = self.position.get(validator_id)
+        return default if i is None else self.keys[i]
+
+
+class Approvals:
+    """
+    Aprobaciones inmutables: bitmap de posiciones firmantes y las firmas en
+    el orden de los bits. with_signature() retorna una copia nueva, así los
+    lectores nunca ven un estado intermedio.
+    """
+
+    __slots__ = ("bitmap", "sigs")
+
+    def __init__(self, bitmap=0, sigs: Tuple[bytes, ...] = ()):
+        self.bitmap = bitmap
+        self.sigs = sigs
+
+    def __len__(self):
+        return len(self.sigs)
+
+    def __contains__(self, pos):
+        return (self.bitmap >> pos) & 1 == 1
+
+    def positions(self):
+        bitmap, pos = self.bitmap, 0
+        while bitmap:
+            if bitmap & 1:
+                yield pos
+            bitmap >>= 1
+            pos += 1
+
+    def items(self):
+        return zip(self.positions(), self.sigs)
+
+    def with_signature(self, pos, sig: bytes):
+        if pos in self:
+            return self
+        rank = bin(self.bitmap & ((1 << pos) - 1)).count("1")
+        return Approvals(self.bitmap | (1 << pos), self.sigs[:rank] + (sig,) + self.sigs[rank:])
+
+    def names(self, vset: ValidatorSet):
+        return [vset.ids[pos] for pos in self.positions()]
+
+    def to_signatures(self, vset: ValidatorSet) -> Dict[str, str]:
+        """Forma de Block.signatures: {validator_id: firma hex}."""
+        return {vset.ids[pos]: sig.hex() for pos, sig in self.items()}
+
+
+def pack_bitmap(bitmap: int) -> bytes:
+    return bitmap.to_bytes((bitmap.bit_length() + 7) // 8, "little")
+
+
+def unpack_bitmap(data: bytes) -> int:
+    return int.from_bytes(data, "little")
+
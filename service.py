@@ -0,0 +1,91 @@
+# service.py
+import os
+
+# ======== SERVICIO DE CONSENSO ========
+# main.py habla solo con este módulo. Con un único proceso el estado de
+# consenso (state.py / block_ops.py) vive aquí mismo. Con varios workers de
+# uvicorn el estado vive en un solo proceso coordinador (coordinator.py):
+# cada worker le reenvía las operaciones de consenso por un socket Unix y
+# lee la cadena directamente del almacén en modo solo lectura. Así hay un
+# único escritor de la cadena y del pool de pendientes, y el orden es el
+# mismo para todos los workers.
+#
+#   python coordinator.py --socket /tmp/blockchain.sock
+#   BLOCKCHAIN_COORDINATOR=/tmp/blockchain.sock uvicorn main:app --workers 4
+
+COORDINATOR_ENV = "BLOCKCHAIN_COORDINATOR"
+
+
+class LocalConsensus:
+    """
+    Estado de consenso en este mismo proceso (un solo worker o el coordinador).
+    Las operaciones son corrutinas, igual que en RemoteConsensus; solo
+    chain_view() es síncrona (se usa desde handlers síncronos).
+    """
+
+    def __init__(self):
+        import state
+        import block_ops
+        self.state = state
+        self.ops = block_ops
+
+    def info(self):
+        return {"directory": self.state.chain.directory}
+
+    async def submit_transaction(self, tx):
+        """Retorna el id de la propuesta si la transacción cerró un lote, o None."""
+        pb = await self.ops.submit_transaction(tx)
+        return pb["id"] if pb else None
+
+    async def sign_pending_block(self, pending_id, validator_id):
+        return await self.ops.sign_pending_block(pending_id, validator_id)
+
+    async def sign_pending_blocks(self, pending_ids, validator_id):
+        return await self.ops.sign_pending_blocks(pending_ids, validator_id)
+
+    async def mark_pending_block_failed(self, pending_id):
+        return await self.ops.mark_pending_block_failed(pending_id)
+
+    async def resolve_pending_ids(self, ids=(), desde=None, hasta=None, validator_id=None, todas=False):
+        return self.ops.resolve_pending_ids(ids, desde, hasta, validator_id, todas)
+
+    async def list_pending_blocks(self, validator_id=None):
+        return self.ops.list_pending_blocks(validator_id)
+
+    def chain_length(self):
+        return len(self.state.chain.chain)
+
+    def chain_view(self):
+        return self.state.chain.snapshot()
+
+    def chain_index(self):
+        return self.state.chain.index
+
+    async def metrics(self):
+        from offload import loop_lag
+        from json_cache import block_json
+        return {
+            "event_loop_lag": loop_lag.stats(),
+            "block_json_cache": block_json.stats(),
+            "mempool_txs": len(self.state.mempool),
+            "pending_blocks": len(self.state.pending_blocks),
+            "chain_blocks": self.chain_length(),
+        }
+
+    def background_tasks(self):
+        """Corrutinas de fondo del dueño del estado: linger del mempool y plazos."""
+        from mempool import run_linger_loop
+        from deadlines import run_expiry_loop
+        return [
+            run_linger_loop(self.state.mempool, self.ops.propose_batch),
+            run_expiry_loop(self.state.deadlines, self.ops.expire_pending_blocks),
+        ]
+
+
+def connect():
+    """Backend de consenso de este proceso según BLOCKCHAIN_COORDINATOR."""
+    address = os.environ.get(COORDINATOR_ENV)
+    if address:
+        from coordinator import RemoteConsensus
+        return RemoteConsensus(address)
+    return LocalConsensus()
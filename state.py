@@ -1,30 +1,66 @@
 # state.py
-from typing import List, Dict, Any
-from blockchain import setup_network, SimpleBlockchain, threshold_q
+from blockchain import setup_network, SimpleBlockchain, SignatureCache, threshold_q
+from mempool import Mempool
+from pending_pool import PendingPool
+from deadlines import DeadlineScheduler
+from chain_writer import ChainWriter
+from keystore import Keystore, KEYSTORE_PATH, validator_count
 import time
 
-# Pending proposals shared across the whole app
-pending_blocks: List[Dict[str, Any]] = []
-
 # Initialize validator nodes
-# NOTA: En un sistema real de persistencia, las claves de los validadores 
-# también deberían cargarse de disco para que sean los "mismos" validadores siempre.
-# Por ahora, regeneramos la red, pero mantenemos la historia de la blockchain.
-validators, others = setup_network(k_validators=5, extra_nodes=3)
+# Las claves se cargan del keystore cifrado (frase de paso en
+# BLOCKCHAIN_KEYSTORE_PASSPHRASE) para que los validadores sean siempre los
+# mismos y sus firmas históricas sigan siendo verificables. La primera vez se
+# genera la red y se guarda después de abrir la cadena.
+keystore = Keystore(KEYSTORE_PATH)
+# El número de validadores de una red nueva se toma de BLOCKCHAIN_VALIDATORS;
+# las cuentas de autoridad (auth/auth.py) salen de los IDs del keystore.
+if keystore.exists():
+    validators, others = keystore.load()
+else:
+    validators, others = setup_network(k_validators=validator_count(), extra_nodes=3)
 
-# Threshold q = floor(2k/3) + 1
-q = threshold_q(len(validators))
+# Búsqueda O(1) de validadores por id y caché de verificaciones de firmas
+validators_by_id = {v.id: v for v in validators}
+sig_cache = SignatureCache()
 
-# Blockchain singleton
-chain = SimpleBlockchain(validators, q, filename="blockchain_data.json")
+# Blockchain singleton (threshold q = floor(2k/3) + 1)
+chain = SimpleBlockchain(validators, threshold_q(len(validators)), directory="blockchain_data")
 
 # --- LÓGICA DE INICIO ---
 # Intentamos cargar la historia previa. Si no existe, creamos el Génesis.
+# Si hubo un cierre abrupto, load_chain trunca solo la cola rota y conserva
+# todos los bloques válidos anteriores.
 if not chain.load_chain():
     print("[INIT] No se encontró historial. Creando Bloque Génesis.")
     chain.genesis()
 else:
     print("[INIT] Historial recuperado correctamente.")
 
-# Global counter for pending block IDs
-pending_id_counter = 1
+# Claves nuevas: su época empieza en la altura actual (los bloques anteriores,
+# firmados con claves que no se guardaron, no pueden verificarse)
+if not keystore.exists():
+    keystore.create(validators, others, from_height=len(chain.chain))
+chain.key_epochs = keystore.epoch_keys()
+
+# Conjunto de validadores de la época vigente: el orden de sus IDs define los
+# bits de aprobación de las propuestas y su umbral es el quórum a reunir.
+validator_set = chain.key_epochs.latest()
+q = validator_set.q
+
+# Solo se re-verifican los bloques posteriores a la última marca verificada
+chain.verify_incremental()
+
+# Único escritor de la cadena: sella y persiste los bloques decididos en orden
+writer = ChainWriter(chain).start()
+
+# Pending proposals shared across the whole app (id -> propuesta, con vistas
+# por validador); el pool también asigna los ids de propuesta.
+pending_blocks = PendingPool(validators_by_id)
+
+# Transacciones en espera de ser agrupadas en un bloque: se corta un bloque
+# al llegar a max_txs transacciones o max_bytes, o tras linger_seconds.
+mempool = Mempool(max_txs=100, max_bytes=256 * 1024, linger_seconds=2.0)
+
+# Plazo de cada propuesta: al vencer sin quórum se registra como REJECTED
+deadlines = DeadlineScheduler(ttl_seconds=300.0)
@@ -0,0 +1,429 @@
+# verify.py
+import os
+import sys
+import json
+import time
+import zlib
+import struct
+import hashlib
+import argparse
+from array import array
+from dataclasses import dataclass, field
+from typing import List, Tuple
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import codec
+import hashing
+from blockchain import Block, EpochKeys, verify_block
+from block_store import BlockStore
+from block_log import atomic_write
+
+# ======== MOTOR DE VERIFICACIÓN PARALELA ========
+# La cadena se divide en rangos de alturas (shards). Cada proceso del pool
+# abre el almacén en modo solo lectura, recalcula hashes y verifica los
+# certificados de su rango; al final se "cosen" los bordes comprobando que el
+# primer bloque de cada rango enlace con el último del rango anterior.
+
+DEFAULT_SHARD_SIZE = 2000
+MAX_ERRORS_PER_SHARD = 100
+
+WATERMARK_FILENAME = "verified.json"
+
+
+@dataclass
+class ShardResult:
+    start: int
+    end: int
+    first_previous_hash: str
+    last_hash: str
+    errors: List[Tuple[int, str]]
+    unkeyed: int = 0        # bloques anteriores a la primera época de claves
+    # (prefijo de 32 bits del digest de contenido << 32) | altura, de cada bloque v4 o posterior
+    content_keys: array = field(default_factory=lambda: array("Q"))
+
+
+@dataclass
+class VerificationReport:
+    blocks: int = 0
+    errors: List[Tuple[int, str]] = field(default_factory=list)   # (altura, mensaje)
+    seconds: float = 0.0
+    signatures_checked: bool = True
+    start: int = 0          # primera altura verificada
+    unkeyed: int = 0        # bloques sin claves para verificar sus firmas (no son errores)
+    known_errors: List[Tuple[int, str]] = field(default_factory=list)  # ya registrados en verified.json
+
+    @property
+    def ok(self):
+        return not self.errors
+
+
+def verify_range(store, start, end, verify_keys, q) -> ShardResult:
+    """
+    Verifica las alturas [start, end) de un almacén abierto. verify_keys es
+    una tabla EpochKeys (o None para omitir firmas). Los bloques anteriores a
+    la primera época (p. ej. firmados con claves que nunca se guardaron) se
+    verifican sin firmas y solo se cuentan en unkeyed.
+    """
+    errors = []
+    unkeyed = 0
+    content_keys = array("Q")
+    first_previous_hash = None
+    prev_hash = None
+    for height in range(start, end):
+        b = store.read_block(height)
+        if height == start:
+            first_previous_hash = b.previous_hash
+        elif b.previous_hash != prev_hash:
+            errors.append((height, "previous_hash no enlaza con el bloque anterior"))
+        if store.block_hash(height) != b.block_hash:
+            errors.append((height, "el hash del índice no coincide con el bloque"))
+        if verify_keys is None:
+            keys, q_height = None, q
+        else:
+            # Conjunto de validadores de la época del bloque; q por defecto, el suyo
+            keys = verify_keys.for_height(height)
+            q_height = q if q is not None else keys.q
+            if keys.epoch < 0:
+                keys, q_height = None, q
+                unkeyed += height > 0       # el génesis no lleva firmas
+        message = b.signing_message()
+        if height and b.hash_version >= hashing.HASH_V4_PIPELINED:
+            content_keys.append(content_key(message, height))
+        errors.extend((height, e) for e in verify_block(b, height, keys, q_height, message))
+        prev_hash = b.block_hash
+    return ShardResult(start, end, first_previous_hash, prev_hash, errors[:MAX_ERRORS_PER_SHARD],
+                       unkeyed, content_keys)
+
+
+def stitch(results) -> List[Tuple[int, str]]:
+    """Comprueba los enlaces entre rangos consecutivos."""
+    errors = []
+    results = sorted(results, key=lambda r: r.start)
+    for prev, cur in zip(results, results[1:]):
+        if cur.first_previous_hash != prev.last_hash:
+            errors.append((cur.start, "previous_hash no enlaza con el bloque anterior"))
+    return errors
+
+
+def content_key(digest_hex, height) -> int:
+    return (int(digest_hex[:8], 16) << 32) | height
+
+
+def duplicate_content(results, get_store) -> List[Tuple[int, str]]:
+    """
+    Bloques v4 o posteriores con el mismo contenido sellado en más de una
+    altura (desde la v5 el nonce de la propuesta lo hace único). Se ordenan
+    claves de 64 bits (prefijo del digest + altura) y solo los prefijos
+    repetidos se confirman releyendo el digest completo (get_store() abre el
+    almacén solo si hace falta).
+    """
+    keys = sorted(k for res in results for k in res.content_keys)
+    errors = []
+    store = None
+    i = 0
+    while i < len(keys):
+        j = i + 1
+        while j < len(keys) and keys[j] >> 32 == keys[i] >> 32:
+            j += 1
+        if j - i > 1:
+            first = {}
+            store = store or get_store()
+            for key in keys[i:j]:
+                height = key & 0xFFFFFFFF
+                digest = store.read_block(height).signing_message()
+                if digest in first:
+                    errors.append((height, f"contenido ya sellado en el bloque #{first[digest]}"))
+                else:
+                    first[digest] = height
+        i = j
+    return errors
+
+
+def shard_ranges(start, end, shard_size):
+    return [(s, min(s + shard_size, end)) for s in range(start, end, shard_size)]
+
+
+# --- Estado de cada proceso del pool (se inicializa una sola vez) ---
+
+_worker = {}
+
+
+def open_store(directory):
+    """Abre el almacén en solo lectura con el decodificador de bloques."""
+    ids = codec.IdTable(os.path.join(directory, "ids.json")).load()
+    store = BlockStore(directory, decode=lambda p: Block.from_dict(codec.decode_record(p, ids)))
+    return store.open_read_only()
+
+
+def _init_worker(directory, keys_json, q):
+    _worker["store"] = open_store(directory)
+    _worker["keys"] = None if keys_json is None else EpochKeys.from_json(keys_json)
+    _worker["q"] = q
+
+
+def _verify_shard(start, end):
+    return verify_range(_worker["store"], start, end, _worker["keys"], _worker["q"])
+
+
+def _segment_crc_ok(path, expected_bytes, expected_crc):
+    with open(path, "rb") as f:
+        data = f.read()
+    return len(data) == expected_bytes and zlib.crc32(data) == expected_crc
+
+
+# --- API ---
+
+def run_verification(directory, start, end, keys_json, q, workers=None,
+                     shard_size=DEFAULT_SHARD_SIZE, progress=None, local_store=None):
+    """
+    Verifica las alturas [start, end). keys_json es EpochKeys.to_json() (se
+    envía así a los procesos del pool) o None para omitir firmas. Con un solo
+    shard (o workers=1) se verifica en el proceso actual usando local_store
+    si se proporciona.
+    """
+    started = time.perf_counter()
+    report = VerificationReport(blocks=end - start, signatures_checked=keys_json is not None, start=start)
+    ranges = shard_ranges(start, end, shard_size)
+    workers = workers or os.cpu_count() or 1
+
+    if workers == 1 or len(ranges) <= 1:
+        store = local_store if local_store is not None else open_store(directory)
+        keys = None if keys_json is None else EpochKeys.from_json(keys_json)
+        results = []
+        for s, e in ranges:
+            results.append(verify_range(store, s, e, keys, q))
+            if progress:
+                progress(e - start, end - start)
+    else:
+        results = []
+        done = 0
+        with ProcessPoolExecutor(max_workers=min(workers, len(ranges)), initializer=_init_worker,
+                                 initargs=(directory, keys_json, q)) as pool:
+            futures = [pool.submit(_verify_shard, s, e) for s, e in ranges]
+            for fut in as_completed(futures):
+                res = fut.result()
+                results.append(res)
+                done += res.end - res.start
+                if progress:
+                    progress(done, end - start)
+
+    for res in results:
+        report.errors.extend(res.errors)
+        report.unkeyed += res.unkeyed
+    report.errors.extend(stitch(results))
+    report.errors.extend(duplicate_content(
+        results, lambda: local_store if local_store is not None else open_store(directory)))
+    report.errors.sort()
+    report.seconds = time.perf_counter() - started
+    return report
+
+
+def verify_segments(directory, workers=None):
+    """Compara el CRC32 de cada segmento sellado con el registrado en meta.json."""
+    meta_path = os.path.join(directory, "meta.json")
+    if not os.path.exists(meta_path):
+        return []   # todavía no hay segmentos sellados
+    with open(meta_path, "r") as f:
+        segments = json.load(f).get("segments", {})
+    errors = []
+    jobs = {
+        seg: (os.path.join(directory, f"segment_{int(seg):06d}.log"), info["bytes"], info["crc32"])
+        for seg, info in segments.items()
+    }
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = {pool.submit(_segment_crc_ok, *args): seg for seg, args in jobs.items()}
+        for fut in as_completed(futures):
+            if not fut.result():
+                errors.append(f"segmento {futures[fut]}: checksum o tamaño no coincide")
+    return sorted(errors)
+
+
+def verify_chain(chain, workers=None, shard_size=DEFAULT_SHARD_SIZE, progress=None):
+    """Verificación completa de una SimpleBlockchain abierta."""
+    keys_json = chain.verify_keys().to_json()
+    return run_verification(chain.directory, 0, len(chain.chain), keys_json, None,
+                            workers=workers, shard_size=shard_size, progress=progress,
+                            local_store=chain.chain)
+
+
+# ======== MARCA DE VERIFICACIÓN INCREMENTAL ========
+# verified.json guarda "verificado hasta la altura H con hash de punta X" y un
+# digest que lo ata a los datos almacenados: la entrada del índice de H, el
+# CRC32 leído de disco del segmento de H hasta el final de su registro y el
+# tamaño/CRC (meta.json) de cada segmento sellado anterior. Además guarda el
+# tamaño y la fecha de modificación de esos segmentos sellados: si alguno
+# cambió desde la marca, se recalcula su CRC en disco y se compara con
+# meta.json. Al arrancar solo se verifican los bloques por encima de H; si el
+# digest o un CRC no coincide con lo que hay en disco, se vuelve a verificar
+# la cadena completa. Así el arranque lee como mucho un segmento completo,
+# más los sellados que hayan sido modificados.
+#
+# Los errores encontrados quedan registrados en la marca ("errors") y la
+# marca avanza igual hasta la punta: un bloque con un error permanente no
+# obliga a re-verificar la cadena en cada arranque. Los errores registrados
+# se informan como conocidos; la verificación completa (verify.py o
+# chain.verify()) los vuelve a calcular desde cero.
+
+MAX_KNOWN_ERRORS = 1000
+CRC_CHUNK_BYTES = 1024 * 1024
+
+
+def _prefix_crc(path, end):
+    """CRC32 de los primeros end bytes del archivo, leído por partes."""
+    crc = 0
+    with open(path, "rb") as f:
+        while end > 0:
+            chunk = f.read(min(CRC_CHUNK_BYTES, end))
+            if not chunk:
+                break
+            crc = zlib.crc32(chunk, crc)
+            end -= len(chunk)
+    return crc
+
+
+def watermark_digest(store, height) -> str:
+    seg_h = store.segment_of(height)
+    end = store.record_end(height)
+    h = hashlib.sha256(b"SCVW")
+    h.update(struct.pack("<Q", height))
+    h.update(store.index_entry(height))
+    h.update(struct.pack("<QQI", seg_h, end, _prefix_crc(store.segment_path(seg_h), end)))
+    segments = store.meta.get("segments", {})
+    for seg in range(seg_h):
+        info = segments.get(str(seg))
+        if info is not None:
+            h.update(struct.pack("<QQI", seg, info["bytes"], info["crc32"]))
+    return h.hexdigest()
+
+
+def _segment_stats(store, height):
+    """{segmento: [bytes, mtime_ns]} de los segmentos sellados anteriores al de height."""
+    stats = {}
+    for seg in range(store.segment_of(height)):
+        st = os.stat(store.segment_path(seg))
+        stats[str(seg)] = [st.st_size, st.st_mtime_ns]
+    return stats
+
+
+def _sealed_unchanged(store, height, recorded):
+    """Los segmentos sellados modificados desde la marca siguen coincidiendo con meta.json."""
+    segments = store.meta.get("segments", {})
+    for seg, stat in _segment_stats(store, height).items():
+        if recorded.get(seg) == stat:
+            continue
+        info = segments.get(seg)
+        if info is None or not _segment_crc_ok(store.segment_path(int(seg)), info["bytes"], info["crc32"]):
+            return False
+    return True
+
+
+def load_watermark(store):
+    """
+    (altura verificada, errores conocidos) según verified.json, o (-1, [])
+    si falta o no es confiable.
+    """
+    path = os.path.join(store.directory, WATERMARK_FILENAME)
+    if not os.path.exists(path):
+        return -1, []
+    try:
+        with open(path, "r") as f:
+            mark = json.load(f)
+        height = mark["height"]
+        if height >= len(store) or store.block_hash(height) != mark["tip_hash"]:
+            return -1, []
+        if watermark_digest(store, height) != mark["digest"]:
+            return -1, []
+        if not _sealed_unchanged(store, height, mark.get("segments", {})):
+            return -1, []
+        return height, [(h, msg) for h, msg in mark.get("errors", [])]
+    except (OSError, ValueError, KeyError, TypeError):
+        return -1, []
+
+
+def save_watermark(store, height, errors=()):
+    mark = {
+        "height": height,
+        "tip_hash": store.block_hash(height),
+        "digest": watermark_digest(store, height),
+        "segments": _segment_stats(store, height),
+        "errors": [list(e) for e in errors][:MAX_KNOWN_ERRORS],
+    }
+    atomic_write(os.path.join(store.directory, WATERMARK_FILENAME), json.dumps(mark, indent=2).encode())
+
+
+def verify_incremental(chain, workers=None, shard_size=DEFAULT_SHARD_SIZE, progress=None):
+    """
+    Verifica solo los bloques por encima de la marca persistida y la avanza
+    hasta la punta, registrando los errores nuevos junto a los ya conocidos.
+    El costo depende de los bloques nuevos, no del largo total de la cadena.
+    """
+    store = chain.chain
+    mark, known = load_watermark(store)
+    start = mark + 1
+    keys_json = chain.verify_keys().to_json()
+    # El primer bloque nuevo debe enlazar con la punta ya verificada
+    if 0 < start < len(store) and store.read_block(start).previous_hash != store.block_hash(mark):
+        link_error = [(start, "previous_hash no enlaza con el bloque anterior")]
+    else:
+        link_error = []
+    report = run_verification(chain.directory, start, len(store), keys_json, None,
+                              workers=workers, shard_size=shard_size, progress=progress,
+                              local_store=store)
+    report.errors = link_error + report.errors
+    report.start = start
+    report.known_errors = known
+
+    if len(store) - 1 > mark:
+        save_watermark(store, len(store) - 1, known + report.errors)
+    return report
+
+
+# ======== CLI ========
+
+def _print_progress(done, total):
+    pct = 100 * done // total if total else 100
+    print(f"[VERIFICACIÓN] {done}/{total} bloques ({pct}%)", file=sys.stderr)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Verificación completa de la blockchain en paralelo.")
+    parser.add_argument("--data", default="blockchain_data", help="directorio del almacén de bloques")
+    parser.add_argument("--workers", type=int, default=None, help="procesos (por defecto, uno por núcleo)")
+    parser.add_argument("--shard-size", type=int, default=DEFAULT_SHARD_SIZE, help="bloques por rango")
+    parser.add_argument("--keys", help="keystore.json, lista de épocas o JSON {validator_id: clave_pública_hex}; "
+                                       "sin él no se verifican firmas")
+    parser.add_argument("--q", type=int, default=None,
+                        help="quórum mínimo (por defecto, el de la época de cada bloque o, sin --keys, el del certificado)")
+    args = parser.parse_args(argv)
+
+    keys_json = None
+    if args.keys:
+        with open(args.keys, "r") as f:
+            keys_json = EpochKeys.from_json(json.load(f)).to_json()
+    q = args.q
+
+    store = open_store(args.data)
+    total = len(store)
+    store.close()
+    print(f"[VERIFICACIÓN] {total} bloques en {args.data}", file=sys.stderr)
+
+    report = run_verification(args.data, 0, total, keys_json, q, workers=args.workers,
+                              shard_size=args.shard_size, progress=_print_progress)
+    seg_errors = verify_segments(args.data, workers=args.workers)
+
+    for height, msg in report.errors[:50]:
+        print(f"  bloque #{height}: {msg}")
+    for msg in seg_errors:
+        print(f"  {msg}")
+    if not report.signatures_checked:
+        print("[VERIFICACIÓN] Firmas no verificadas (use --keys).", file=sys.stderr)
+    elif report.unkeyed:
+        print(f"[VERIFICACIÓN] {report.unkeyed} bloques anteriores a la primera época de claves: "
+              f"firmas no verificables, solo se comprobaron hashes y enlaces.", file=sys.stderr)
+    rate = report.blocks / report.seconds if report.seconds else 0
+    print(f"[VERIFICACIÓN] {report.blocks} bloques en {report.seconds:.2f}s ({rate:.0f} bloques/s), "
+          f"{len(report.errors) + len(seg_errors)} errores.")
+    return 0 if report.ok and not seg_errors else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())